@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Aggregation of project-level data into IOU-month-year totals.
+
+Concurrent totals are computed with a sweep line: each project's
+[month_year_receive, month_year_complete] interval becomes a +value event at
+its receive month and a -value event the month after it completes, and a
+per-IOU cumulative sum over the sorted events gives the total over every
+project open in a month.
+
+The rollup is merged from partial totals (completed totals and sweep line
+events) by IOU and receive month, added in order of receive month. Partial
+totals can be computed for all projects at once in memory or one chunk of
+projects at a time (out_of_core.py), with results equal up to rounding.
+Concurrent totals of arbitrary IOU-month-years are looked up in a
+lifetimes.LifetimeIndex.
+
+Panels by finer groups (e.g. installer and IOU) are merged the same way from
+partial totals keyed by those groups instead of the IOU (rollup_panel, or
+panel_partial and merge_panel chunk by chunk). The
+running sums of every group are taken in one sorted pass, so the cost does not
+grow with the number of groups.
+"""
+
+import pandas as pd
+import numpy as np
+
+from lifetimes import LifetimeIndex
+
+
+def sum_present(data, cols, min_count = 1):
+    '''
+    returns the row sums of data[cols] as a float64 array, skipping NaNs, with
+    NaN in rows with fewer than min_count values present (instead of the zero
+    a plain sum would give). Works on the columns as one numpy block.
+    '''
+    block = data[cols].to_numpy(dtype = 'float64', na_value = np.nan)
+    present = ~np.isnan(block)
+
+    totals = np.where(present, block, 0).sum(axis = 1)
+    totals[present.sum(axis = 1) < min_count] = np.nan
+
+    return totals
+
+
+def sum_concurrent(data, ioumy, outcomes):
+    '''
+    returns a dataframe aligned to ioumy with the sum of each outcome over the
+    projects in the IOU engaged in at any point in the month-year, i.e. with
+    month_year_receive <= month_year_complete of ioumy <= month_year_complete.
+    Completed projects are counted as concurrent projects. A cell where no
+    concurrent project has a non-NaN value gets NaN.
+    '''
+    lifetimes = LifetimeIndex(data, outcomes, grain = 'month', start = 'month_year_receive', end = 'month_year_complete')
+    totals = lifetimes.query(ioumy.iou.to_numpy(dtype = object), ioumy.month_year_complete.to_numpy())
+
+    return totals.set_axis(ioumy.index)
+
+
+def ioumy_keys(data):
+    '''
+    returns the unique IOU-month-years in which a project was completed, in order
+    of first appearance in data
+    '''
+    ioumy = data[['iou', 'month_year_complete']].drop_duplicates()
+
+    return ioumy.dropna().reset_index(drop = True)
+
+
+def month_after(months):
+    '''
+    returns the first day of the month after each month-year in months
+    '''
+    months = np.asarray(months)
+
+    return (months.astype('datetime64[M]') + 1).astype(months.dtype)
+
+
+def partial_rollup(data, outcomes, pos = None, by = ('iou',)):
+    '''
+    returns the partial totals of the projects in data from which the rollup is
+    merged, as a (complete, events) pair of dataframes indexed by the group
+    columns in by (default: iou), receive month and month, with {outcome}_sum
+    and {outcome}_count (number of non-NaN values) columns: complete totals the
+    projects completed in the month, and holds in first the position of the
+    earliest of them; events is the change in concurrent totals at the start of
+    the month, as projects enter in their receive month and leave the month
+    after they complete. pos gives the position of each row in the full data
+    (default: its row number).
+
+    Every total sums the rows of one group and receive month in their order in
+    data, so the partial totals of a partition of the projects by group and
+    receive month are the same whether computed together or one partition at
+    a time.
+    '''
+    if pos is None:
+        pos = np.arange(data.shape[0])
+    by = list(by)
+
+    values = data[outcomes].to_numpy(dtype = 'float64', na_value = np.nan)
+    present = ~np.isnan(values)
+    stats = {}
+    for j, o in enumerate(outcomes):
+        stats[f'{o}_sum'] = np.where(present[:, j], values[:, j], 0)
+    for j, o in enumerate(outcomes):
+        stats[f'{o}_count'] = present[:, j].astype('int64')
+    stats = pd.DataFrame(stats)
+
+    groups = [data[c].to_numpy(dtype = object) for c in by]
+    receive = data.month_year_receive.to_numpy()
+    complete = data.month_year_complete.to_numpy()
+    names = by + ['receive', 'month']
+
+    #projects completed in each month (none without a completion date)
+    done = ~pd.isna(complete)
+    totals = stats.loc[done].assign(first = pos[done])
+    totals = totals.groupby([g[done] for g in groups] + [receive[done], complete[done]], sort = False, dropna = False).agg(
+        {**{c: 'sum' for c in stats.columns}, 'first': 'min'}
+    )
+    totals.index.names = names
+
+    #projects enter in their receive month and leave the month after completion
+    valid = done & ~pd.isna(receive)
+    valid[valid] = receive[valid] <= complete[valid]
+    stats = stats.loc[valid]
+    groups = [g[valid] for g in groups]
+    receive, complete = receive[valid], complete[valid]
+    enter = stats.groupby(groups + [receive, receive], sort = False).sum()
+    leave = stats.groupby(groups + [receive, month_after(complete)], sort = False).sum()
+    events = pd.concat([enter, -leave])
+    events.index.names = names
+
+    return totals, events
+
+
+def merge_partials(partials, outcomes, cells = None, by = ('iou',)):
+    '''
+    returns the rollup by the group columns in by (default: the IOU-month-year
+    rollup, as rollup_ioumy) merged from the partial_rollup of disjoint
+    partitions of the projects (e.g. chunks of rows). Partial totals are added
+    in order of receive month, so the result does not depend on the order of
+    partials, and only on the partitions through rounding. If cells (a
+    dataframe of the by columns and month_year_complete) is given, only those
+    cells are returned.
+    '''
+    by = list(by)
+    levels = by + ['month']
+
+    totals = pd.concat([p[0] for p in partials]).sort_index()
+    totals = totals.groupby(level = levels, sort = False).agg(
+        {**{c: 'sum' for c in totals.columns if c != 'first'}, 'first': 'min'}
+    )
+    events = pd.concat([p[1] for p in partials]).sort_index()
+    events = events.groupby(level = levels, sort = False).sum().sort_index()
+
+    if cells is None:
+        #cells in order of the first project completed in them
+        ioumy = totals.sort_values('first', kind = 'mergesort').index.to_frame(index = False)
+        ioumy.columns = by + ['month_year_complete']
+    else:
+        ioumy = cells[by + ['month_year_complete']].reset_index(drop = True)
+    keys = pd.MultiIndex.from_frame(ioumy)
+
+    #completed totals, NaN where no project has a value
+    totals = totals.reindex(keys)
+    for o in outcomes:
+        ioumy[f'{o}_complete'] = totals[f'{o}_sum'].where(totals[f'{o}_count'] > 0).to_numpy()
+
+    #concurrent totals: running sums of the events of each group up to and
+    #including each month, for all groups in one pass over the sorted events
+    sum_cols = [f'{o}_sum' for o in outcomes]
+    count_cols = [f'{o}_count' for o in outcomes]
+    concurrent = np.full((ioumy.shape[0], len(outcomes)), np.nan)
+    if events.shape[0] > 0:
+        codes, groups = pd.factorize(pd.MultiIndex.from_arrays([events.index.get_level_values(c) for c in by]))
+        sums = events[sum_cols].groupby(codes, sort = False).cumsum().to_numpy()
+        counts = events[count_cols].groupby(codes, sort = False).cumsum().to_numpy()
+
+        #groups and months combined into one sortable integer key
+        months = events.index.get_level_values('month').to_numpy().astype('datetime64[M]').astype('int64')
+        base, top = months.min(), months.max()
+        span = top - base + 2
+        query_codes = groups.get_indexer(pd.MultiIndex.from_frame(ioumy[by]))
+        query_months = ioumy.month_year_complete.to_numpy().astype('datetime64[M]').astype('int64')
+        query_months = np.clip(query_months, base - 1, top + 1)
+
+        #state after the last event of the same group at or before each query month
+        pos = np.searchsorted(codes * span + (months - base), query_codes * span + (query_months - base), side = 'right') - 1
+        hit = (query_codes >= 0) & (pos >= 0)
+        hit[hit] = codes[pos[hit]] == query_codes[hit]
+        concurrent[hit] = np.where(counts[pos[hit]] > 0, sums[pos[hit]], np.nan)
+
+    for j, o in enumerate(outcomes):
+        ioumy[f'{o}_concurrent'] = concurrent[:, j]
+
+    cols = by + ['month_year_complete']
+    for o in outcomes:
+        cols += [f'{o}_complete', f'{o}_concurrent']
+
+    return ioumy[cols]
+
+
+def rollup_ioumy(data, outcomes, cells = None):
+    '''
+    returns the IOU-month-year sample: one row per IOU and month-year in which
+    a project was completed, with {outcome}_complete and {outcome}_concurrent
+    columns for each outcome. If cells (a dataframe of iou, month_year_complete)
+    is given, only those IOU-month-years are computed, from the projects that
+    can touch them. Totals are merged from partial totals by IOU and receive
+    month, as out_of_core.py merges them from the partials of each chunk.
+    '''
+    if cells is not None:
+        data = data.loc[
+            data.iou.isin(cells.iou.unique())
+            & (data.month_year_receive <= cells.month_year_complete.max())
+            & (data.month_year_complete >= cells.month_year_complete.min())
+        ]
+
+    return merge_partials([partial_rollup(data, outcomes)], outcomes, cells)
+
+
+def panel_partial(data, outcomes, by, pos = None):
+    '''
+    returns the partial_rollup by the columns in by of the projects of data
+    with every one of them present (projects with a missing key are left out
+    of panels)
+    '''
+    by = list(by)
+    keep = data[by].notna().all(axis = 1).to_numpy()
+    if pos is not None:
+        pos = np.asarray(pos)[keep]
+
+    return partial_rollup(data.loc[keep], outcomes, pos, by = by)
+
+
+def merge_panel(partials, outcomes, by):
+    '''
+    returns the panel by the columns in by merged from the panel_partial of
+    disjoint partitions of the projects, with rows sorted by group, then
+    month-year
+    '''
+    by = list(by)
+    panel = merge_partials(partials, outcomes, by = by)
+    panel['month_year_complete'] = panel.month_year_complete.astype('datetime64[ns]')
+
+    return panel.sort_values(by + ['month_year_complete'], kind = 'mergesort', ignore_index = True)
+
+
+def rollup_panel(data, outcomes, by):
+    '''
+    returns the panel of data by the columns in by (e.g. installer and iou) and
+    month-year: one row per group and month-year in which a project of the
+    group was completed, with {outcome}_complete and {outcome}_concurrent
+    columns for each outcome as in rollup_ioumy, which it equals for by =
+    ['iou'] up to row order. Rows are sorted by group, then month-year, and
+    projects with a missing key are left out.
+    '''
+    panel = merge_panel([panel_partial(data, outcomes, by)], outcomes, by)
+    for c in by:
+        panel[c] = panel[c].astype(data[c].dtype)
+
+    return panel
+
+
+def affected_cells(ioumy, projects):
+    '''
+    returns a boolean mask over ioumy of the IOU-month-years that any of projects
+    was completed in or concurrent with, i.e. the cells whose totals change when
+    those projects are added or removed.
+    '''
+    projects = projects.assign(project = 1.0)
+    concurrent = sum_concurrent(projects, ioumy, ['project']).project.notna()
+
+    keys = pd.MultiIndex.from_frame(ioumy[['iou', 'month_year_complete']])
+    complete = keys.isin(pd.MultiIndex.from_frame(projects[['iou', 'month_year_complete']]))
+
+    return concurrent.to_numpy() | complete
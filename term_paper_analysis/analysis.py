@@ -7,48 +7,37 @@ Created on Tue Nov 30 14:45:49 2021
 """
 
 import pandas as pd
-import statsmodels.api as sm
 from statsmodels.iolib.summary2 import summary_col
-import numpy as np
-from matplotlib import pyplot as plt
+
+from schedule import load_cutoffs
+from ols import regressors, fit_batch, fitted_values, fit_statsmodels
+from storage import read_sample, read_ioumy
+from figures import render
+from slices import SliceCache
 
 
 ##############################################################################
 #import cutoff data
 ##############################################################################
 
-pge_cutoffs = pd.read_stata('../data/cutoffs/pgecutoffs.dta')
-pge_cutoffs['utility'] = 'pge'
-pge_cutoffs = pge_cutoffs.rename(columns={'pge_day': 'day'})
-
-sce_cutoffs = pd.read_stata('../data/cutoffs/scecutoffs.dta')
-sce_cutoffs['utility'] = 'sce'
-sce_cutoffs = sce_cutoffs.rename(columns = {'sce_day': 'day'})
-
-sdge_cutoffs = pd.read_stata('../data/cutoffs/sdgecutoffs.dta')
-sdge_cutoffs['utility'] = 'sdge'
-sdge_cutoffs = sdge_cutoffs.rename(columns = {'sdge_day': 'day'})
-
-cutoffs = pd.concat([pge_cutoffs, sce_cutoffs, sdge_cutoffs])
-
-###create date column unifying year, month, day
-
-#first add leading zeros
-cutoffs.month = cutoffs.month.apply(lambda x: str(x).zfill(2))
-cutoffs.day = cutoffs.day.apply(lambda x: str(x).zfill(2))
-
-#create date column
-cutoffs['date'] = cutoffs.apply(
-    lambda x: pd.to_datetime(f'{x.year}-{x.month}-{x.day}', format = '%Y-%m-%d'),
-    axis = 1,
-)
+cutoffs = pd.concat([load_cutoffs(iou) for iou in ['pge', 'sce', 'sdge']])
 
 ##############################################################################
 #import sample and IOU-month-year data
 ##############################################################################
 
-sample = pd.read_csv('sample.csv')
-ioumy = pd.read_csv('ioumy.csv')
+#only load the columns used below
+sample = read_sample(columns = ['iou', 'date_complete'])
+ioumy = read_ioumy(
+    columns = [
+        'iou',
+        'month_year',
+        'size_comp',
+        'size_conc',
+        'q_comp',
+        'q_conc',
+    ],
+)
 
 #change column names
 sample = sample.rename(
@@ -56,31 +45,6 @@ sample = sample.rename(
         'date_complete': 'date',
         },
 )
-ioumy = ioumy.rename(
-    columns = {
-        'month_year_complete': 'month_year',
-        'size_dc_complete': 'size_comp',
-        'size_dc_concurrent': 'size_conc',
-        'gen_q_complete': 'gen_q_comp',
-        'gen_q_concurrent': 'gen_q_conc',
-        'inv_q_complete': 'inv_q_comp',
-        'inv_q_concurrent': 'inv_q_conc',
-        },
-)
-
-#turn dates into datetimes
-sample.date = pd.to_datetime(sample.date)
-ioumy.month_year = pd.to_datetime(ioumy.month_year)
-
-#create columns for total quantity of inverters and generators completed and concurrent
-ioumy['q_comp'] = ioumy.apply(
-    lambda x: x.gen_q_comp + x.inv_q_comp if np.any(x[['gen_q_comp', 'inv_q_comp']].notna()) else np.nan,
-    axis = 1,
-)
-ioumy['q_conc'] = ioumy.apply(
-    lambda x: x.gen_q_conc + x.inv_q_conc if np.any(x[['gen_q_conc', 'inv_q_conc']].notna()) else np.nan,
-    axis = 1,
-)
 
 
 ##############################################################################
@@ -99,9 +63,9 @@ ioumy = ioumy.loc[
 
 #declare IOUs to analyze
 ious = [
-        'SDGE',
-        'SCE',
-        'PGE'
+        'sdge',
+        'sce',
+        'pge'
 ]
 
 #declare regressions in dictionary for later query
@@ -131,6 +95,11 @@ new_names = {
     'constant': 'Constant',
 }
 
+#fit every regression in every IOU in one batched solve
+slices = SliceCache(ioumy, group = 'iou')
+prod_fits = fit_batch(slices.df, regressions, ious, group = 'iou', slices = slices)
+print(prod_fits)
+
 for reg_title, var in regressions.items():
     
     #create empty list to OLS results  
@@ -138,30 +107,23 @@ for reg_title, var in regressions.items():
     prod_res_names = []
     
     #find max values among IOUS to set consistent limits to axes for plots below
-    y_max = ioumy[var['endog']].max()
-    x_max = ioumy[var['exog']].iloc[:,0].max()
+    y_max = slices.max(var['endog'])
+    x_max = slices.max(var['exog'][0])
     
     for iou in ious:
-        #select IOU sub sample, copy to enable addition of fitted values later
-        sub_ioumy = ioumy.loc[ioumy.utility == iou][var['exog'] + [var['endog']]].copy()
-        w_nans = sub_ioumy.shape[0]
-        #drop NaN
-        sub_ioumy.dropna(inplace = True)
+        #select IOU sub sample without NaN, shared by every regression on the same columns
+        w_nans = slices.rows(iou)
+        sub_ioumy = slices.select(iou, regressors(var['exog']) + [var['endog']])
         wo_nans = sub_ioumy.shape[0]
         print(f'NaNs for {reg_title} in {iou}: {w_nans - wo_nans} out of {w_nans}')
 
         
-        #get endogenous and exogenous variables
-        endog = sub_ioumy[var['endog']]
-        exog = sub_ioumy[var['exog']]
-        
-        #OLS
-        ols = sm.OLS(endog, exog)
-        ols_res = ols.fit()
+        #full OLS result, only needed for the summary table
+        ols_res = fit_statsmodels(sub_ioumy, var['endog'], var['exog'])
         
         #add to lists for summary table
         prod_res.append(ols_res)
-        prod_res_names.append(iou)
+        prod_res_names.append(iou.upper())
         
         #rename regressors for summary table
         names = ols_res.model.exog_names
@@ -171,36 +133,26 @@ for reg_title, var in regressions.items():
             names[i] = new_name
             
         #add fitted values to sub_ioumy dataframe for plots
-        sub_ioumy['fitted'] = ols_res.fittedvalues
+        sub_ioumy = sub_ioumy.assign(fitted = fitted_values(prod_fits, sub_ioumy, reg_title, var['exog'], iou, group = 'iou'))
         
 
-        #create plot with best fit line
-        fig, ax = plt.subplots(figsize = (8,6))
-        sub_ioumy.plot(
-            x = exog.iloc[:,0].name, 
-            y = endog.name, 
-            kind = 'scatter', 
-            ax = ax,
-        )
-        sub_ioumy.plot(
-            x = exog.iloc[:,0].name, 
-            y = 'fitted', 
-            kind = 'line', 
-            ax = ax, 
-            color='red', 
-            legend = False,
-        )
-        ax.set_ylabel(f'{reg_title} Installed Per Month')
-        ax.set_xlabel(f'Concurrent {reg_title} Committed To Per Month')
-        ax.set_title(f'{iou}, {reg_title} (N Months = {sub_ioumy.shape[0]})')
-        ax.set_aspect('equal')
-                
-        #find max values to set limits to axes
-        ax.set_xlim(0, 1.1*x_max)
-        ax.set_ylim(0,1.1*y_max)
-        
-        # #export figures
-        # fig.savefig(f"../term paper/{var['endog']}_{iou}_CSI.png")
+        #create plot with best fit line, only drawn once given a path to export to
+        render({
+            'kind': 'fit',
+            'data': sub_ioumy,
+            'x': var['exog'][0],
+            'y': var['endog'],
+            'fitted': 'fitted',
+            'figsize': (8,6),
+            'ylabel': f'{reg_title} Installed Per Month',
+            'xlabel': f'Concurrent {reg_title} Committed To Per Month',
+            'title': f'{iou.upper()}, {reg_title} (N Months = {sub_ioumy.shape[0]})',
+            'aspect': 'equal',
+            'xlim': (0, 1.1*x_max),
+            'ylim': (0, 1.1*y_max),
+            #export figures
+            'path': None, # f"../term paper/{var['endog']}_{iou}_CSI.png"
+        })
 
     #create summary table
     sum_table = summary_col(
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of every pipeline stage on synthetic data.
+
+For each scale, a synthetic data directory is written once (see synthetic.py)
+and the stages run in pipeline order, each on the output of the one before:
+ingest (chunked read and clean), window filter, subsidy lookup, sample
+creation, IOU-month-year rollup, regressions (batched productivity OLS and
+the fixed effects subsidy regression) and plotting. The stages run twice: once
+with tracemalloc to record the peak traced memory of each stage, then untraced
+to time them, since tracing slows stages down by different factors.
+
+Results are compared with a stored baseline: a stage fails when it is more
+than a tolerance slower or more memory hungry than its baseline (ignoring
+differences below a small absolute floor, which are noise). The script exits
+with status 1 on any regression. Baselines are machine specific, so record
+one with --update-baseline on the machine that runs the comparison.
+
+    python benchmark.py [--scales 10k 1m 10m] [--update-baseline]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+import tempfile
+import tracemalloc
+
+import pandas as pd
+import numpy as np
+
+import synthetic
+
+BASELINE_PATH = 'benchmark_baseline.json'
+DATA_DIR = 'benchmark_data'
+
+#rows of each benchmark scale
+scales = {
+    '10k': 10000,
+    '1m': 1000000,
+    '10m': 10000000,
+}
+
+ious = ['pge', 'sce', 'sdge']
+
+
+def measure(func, *args, **kwargs):
+    '''
+    returns (result, seconds) of calling func
+    '''
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+
+    return result, time.perf_counter() - start
+
+
+def measure_peak(func, *args, **kwargs):
+    '''
+    returns (result, peak MB of memory traced) of calling func
+    '''
+    tracemalloc.start()
+    try:
+        result = func(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+    return result, peak
+
+
+def dataset(scale, data_dir = DATA_DIR):
+    '''
+    returns the synthetic data directory of a scale, writing it on first use
+    '''
+    root = os.path.join(data_dir, scale)
+    done = os.path.join(root, 'complete')
+    if not os.path.exists(done):
+        synthetic.write_dataset(root, scales[scale], ious = ious)
+        open(done, 'w').close()
+
+    return root
+
+
+def run_stages(root, work_dir, trace = False):
+    '''
+    runs every stage on the data directory root and returns {stage: seconds},
+    or {stage: peak MB} if trace
+    '''
+    from schedule import load_cutoffs
+    from ingest import read_projects, window_filter
+    from subsidy import find_subsidies
+    from aggregate import rollup_ioumy
+    from ols import fit_batch
+    from fixed_effects import fit_fe
+    from features import time_features
+    from figures import render
+    from slices import SliceCache
+    import data_clean
+    import prod_analysis
+
+    results = {}
+
+    def stage(name, func, *args, **kwargs):
+        result, results[name] = (measure_peak if trace else measure)(func, *args, **kwargs)
+        return result
+
+    cutoffs = pd.concat([
+        load_cutoffs(iou, cutoff_dir = os.path.join(root, 'cutoffs'), cache_dir = os.path.join(work_dir, 'cutoff_cache'))
+        for iou in ious
+    ], ignore_index = True)
+
+    data = stage(
+        'ingest',
+        read_projects,
+        [synthetic.csv_path(root, iou) for iou in ious],
+        cutoffs,
+        chunksize = data_clean.chunksize,
+    )
+
+    #already filtered, but the filter still scans every row
+    stage('window_filter', window_filter, data, cutoffs)
+
+    stage('find_subsidies', find_subsidies, data, cutoffs)
+
+    data = stage('create_sample', data_clean.create_sample, data, cutoffs)
+
+    def rollup(data):
+        return data_clean.format_ioumy(rollup_ioumy(data, data_clean.outcomes))
+    ioumy = stage('rollup', rollup, data)
+
+    def regressions(data, ioumy):
+        fits = fit_batch(ioumy, prod_analysis.regressions, ious)
+        sample = data.dropna(subset = ['gen_q', 'month_year_receive'])
+        sample = sample.loc[(sample.subsidy > 0) & (sample.gen_q > 0)]
+        month, year, myr_value = time_features(sample.month_year_receive)
+        sample = sample.assign(
+            log_gen_q = np.log(sample.gen_q.astype('float64')),
+            log_subsidy = np.log(sample.subsidy),
+            myr_value = myr_value,
+            month = month,
+            year = year,
+        )
+        fe = [
+            fit_fe(sample.loc[sample.iou == iou], 'log_gen_q', ['log_subsidy', 'myr_value'], ['month', 'year'])
+            for iou in ious
+        ]
+        return fits, fe
+    fits, _ = stage('regressions', regressions, data, ioumy)
+
+    def plotting(data, ioumy, fits):
+        paths = []
+        slices = SliceCache(ioumy)
+        for reg_title, var in prod_analysis.regressions.items():
+            spec = prod_analysis.plot_spec(slices, fits, reg_title, var, ious[0])
+            spec['path'] = os.path.join(work_dir, f"{var['endog']}.png")
+            paths.append(render(spec))
+        sub = data.loc[data.iou == ious[0], ['month_year_receive', 'subsidy']].dropna()
+        paths.append(render({
+            'kind': 'hist',
+            'data': sub,
+            'x': 'month_year_receive',
+            'y': 'subsidy',
+            'bins': 50,
+            'figsize': (16,8),
+            'path': os.path.join(work_dir, 'hist.png'),
+        }))
+        return paths
+    stage('plotting', plotting, data, ioumy, fits)
+
+    return results
+
+
+def benchmark(root, work_dir):
+    '''
+    returns {stage: {'seconds', 'peak_mb'}} of every stage on the data
+    directory root, from a traced and an untraced run
+    '''
+    peaks = run_stages(root, work_dir, trace = True)
+    seconds = run_stages(root, work_dir)
+
+    results = {}
+    for name in seconds:
+        results[name] = {'seconds': seconds[name], 'peak_mb': peaks[name]}
+        print(f'  {name:<16}{seconds[name]:>10.3f} s{peaks[name]:>12.1f} MB', file = sys.stderr)
+
+    return results
+
+
+def compare(results, baseline, tolerance = .25, min_seconds = .05, min_mb = 5):
+    '''
+    returns the regressions of results against baseline, as messages
+    '''
+    failures = []
+    for scale, stages in results.items():
+        for name, res in stages.items():
+            base = baseline.get(scale, {}).get(name)
+            if base is None:
+                continue
+            if res['seconds'] > base['seconds'] * (1 + tolerance) + min_seconds:
+                failures.append(f"{scale} {name}: {res['seconds']:.3f} s vs baseline {base['seconds']:.3f} s")
+            if res['peak_mb'] > base['peak_mb'] * (1 + tolerance) + min_mb:
+                failures.append(f"{scale} {name}: {res['peak_mb']:.1f} MB vs baseline {base['peak_mb']:.1f} MB")
+
+    return failures
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Benchmark the pipeline stages on synthetic data.')
+    parser.add_argument('--scales', nargs = '+', default = list(scales), choices = list(scales))
+    parser.add_argument('--baseline', default = BASELINE_PATH, help = 'baseline json to compare with')
+    parser.add_argument('--update-baseline', action = 'store_true', help = 'store these results as the baseline')
+    parser.add_argument('--tolerance', type = float, default = .25, help = 'relative slowdown or memory growth allowed')
+    parser.add_argument('--data-dir', default = DATA_DIR, help = 'where synthetic data is written')
+    args = parser.parse_args()
+
+    #figures are rendered headless, and libraries imported lazily by the stages are
+    #imported up front so their import time is not charged to the first scale
+    import matplotlib
+    matplotlib.use('Agg')
+    for module in ['matplotlib.pyplot', 'scipy.stats']:
+        importlib.import_module(module)
+
+    results = {}
+    for scale in args.scales:
+        print(f'{scale}:', file = sys.stderr)
+        root = dataset(scale, args.data_dir)
+        with tempfile.TemporaryDirectory() as work_dir:
+            results[scale] = benchmark(root, work_dir)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    if args.update_baseline or not baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent = 2)
+        print(f'baseline written to {args.baseline}', file = sys.stderr)
+        sys.exit(0)
+
+    failures = compare(results, baseline, args.tolerance)
+    for failure in failures:
+        print(f'REGRESSION {failure}', file = sys.stderr)
+    print(f'{len(failures)} regression(s)', file = sys.stderr)
+    sys.exit(1 if failures else 0)
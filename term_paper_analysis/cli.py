@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Command line interface to the cleaning and analysis steps.
+
+    python cli.py clean [--engine out_of_core] [--incremental] [--processes N]
+    python cli.py prod [--no-tables] [--no-figures] [--no-rolling]
+    python cli.py subsidy [--no-inference] [--no-figures] [--reps N]
+    python cli.py installers [--min-months N]
+    python cli.py cutoffs [--bandwidths 7 14 30 ...]
+    python cli.py figures
+
+Every step is also an importable function (data_clean.main, prod_analysis.main,
+subsidy_analysis.main, installer_analysis.main, event_study.main and the
+functions they call), and importing a module runs nothing. Each subcommand imports only the modules
+it needs, so `clean` never loads statsmodels or matplotlib: statsmodels is
+imported when a summary table is written and matplotlib when a figure is
+drawn.
+"""
+
+import sys
+import argparse
+
+
+def clean(args):
+    import data_clean
+
+    if args.processes is not None:
+        data_clean.processes = args.processes
+    if args.rows is not None:
+        data_clean.rows = args.rows
+    data_clean.incremental = args.incremental or data_clean.incremental
+
+    data_clean.main(engine = args.engine or data_clean.engine)
+
+
+def prod(args):
+    import prod_analysis
+
+    prod_analysis.main(tables = not args.no_tables, figures = not args.no_figures, rolling = not args.no_rolling)
+
+
+def subsidy(args):
+    import subsidy_analysis
+
+    if args.reps is not None:
+        subsidy_analysis.reps = args.reps
+    subsidy_analysis.export_hist = args.export_hist or subsidy_analysis.export_hist
+
+    subsidy_analysis.main(inference = not args.no_inference, figures = not args.no_figures)
+
+
+def installers(args):
+    import installer_analysis
+
+    if args.min_months is not None:
+        installer_analysis.min_months = args.min_months
+
+    installer_analysis.main()
+
+
+def cutoffs(args):
+    import event_study
+
+    if args.bandwidths is not None:
+        event_study.bandwidths = args.bandwidths
+
+    event_study.main()
+
+
+def figures(args):
+    import prod_analysis
+    import subsidy_analysis
+    from figures import render_all
+
+    #productivity fits are cheap batched solves, so they are refit for the figures
+    prod_analysis.main(tables = False, figures = True, rolling = False)
+    render_all(subsidy_analysis.hist_specs(subsidy_analysis.load_sample(), export = True))
+
+
+def parser():
+    '''
+    returns the argument parser of the command line interface
+    '''
+    parser = argparse.ArgumentParser(description = 'Clean the CSI data and run the analyses.')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+
+    command = commands.add_parser('clean', help = 'clean the CSI files into the sample and ioumy')
+    command.add_argument('--engine', choices = ['memory', 'out_of_core'], help = 'default: data_clean.engine')
+    command.add_argument('--incremental', action = 'store_true', help = 'only re-clean new or changed applications')
+    command.add_argument('--processes', type = int, help = 'processes to clean IOUs in')
+    command.add_argument('--rows', type = int, help = 'rows to import from each file')
+    command.set_defaults(func = clean)
+
+    command = commands.add_parser('prod', help = 'productivity regressions, tables and figures')
+    command.add_argument('--no-tables', action = 'store_true', help = 'skip the summary tables')
+    command.add_argument('--no-figures', action = 'store_true', help = 'skip the figures')
+    command.add_argument('--no-rolling', action = 'store_true', help = 'skip the rolling and expanding window fits')
+    command.set_defaults(func = prod)
+
+    command = commands.add_parser('subsidy', help = 'subsidy regressions, inference and histograms')
+    command.add_argument('--no-inference', action = 'store_true', help = 'skip the bootstrap and placebo tests')
+    command.add_argument('--no-figures', action = 'store_true', help = 'skip the histograms')
+    command.add_argument('--export-hist', action = 'store_true', help = 'save the histograms')
+    command.add_argument('--reps', type = int, help = 'bootstrap replicates')
+    command.set_defaults(func = subsidy)
+
+    command = commands.add_parser('installers', help = 'productivity regressions of every installer')
+    command.add_argument('--min-months', type = int, help = 'fewest months an installer is fitted on')
+    command.set_defaults(func = installers)
+
+    command = commands.add_parser('cutoffs', help = 'jumps in applications around every subsidy cutoff')
+    command.add_argument('--bandwidths', type = int, nargs = '+', help = 'days on each side of a cutoff')
+    command.set_defaults(func = cutoffs)
+
+    command = commands.add_parser('figures', help = 'render every figure of the paper')
+    command.set_defaults(func = figures)
+
+    return parser
+
+
+def main(argv = None):
+    args = parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+
+    sys.exit(main())
@@ -6,210 +6,62 @@ Created on Tue Nov 30 14:01:58 2021
 @author: ivananich
 """
 
+import functools
+
 import pandas as pd
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from schedule import load_cutoffs
+from ingest import read_raw, read_projects, clean_projects, concat_projects, smallest_int, slot_cols
+from subsidy import find_subsidies
+from aggregate import sum_present, ioumy_keys, rollup_ioumy, rollup_panel, affected_cells
+from incremental import STATE_DIR, hash_rows, hash_frame, load_state, save_state, unchanged_rows
+from storage import write_sample, write_ioumy, write_panel
+from instrument import stage
+
+#declare IOUs to clean (sample and ioumy are output in this order)
+ious = [
+    'sdge',
+    'sce',
+    'pge',
+]
 
-##############################################################################
-#import cutoff data
-##############################################################################
-
-pge_cutoffs = pd.read_stata('../data/cutoffs/pgecutoffs.dta')
-pge_cutoffs['iou'] = 'pge'
-pge_cutoffs = pge_cutoffs.rename(columns={'pge_day': 'day'})
-
-sce_cutoffs = pd.read_stata('../data/cutoffs/scecutoffs.dta')
-sce_cutoffs['iou'] = 'sce'
-sce_cutoffs = sce_cutoffs.rename(columns = {'sce_day': 'day'})
-
-sdge_cutoffs = pd.read_stata('../data/cutoffs/sdgecutoffs.dta')
-sdge_cutoffs['iou'] = 'sdge'
-sdge_cutoffs = sdge_cutoffs.rename(columns = {'sdge_day': 'day'})
+#declare how many rows to import from each file (set to None if using all)
+rows = None
 
-cutoffs = pd.concat([pge_cutoffs, sce_cutoffs, sdge_cutoffs])
+#declare how many rows to stream at a time (set to None to read each file at once)
+chunksize = 100000
 
-###create date column unifying year, month, day
+#declare how many processes to clean IOUs in (set to 1 to clean them serially)
+processes = 3
 
-#first add leading zeros
-cutoffs.month = cutoffs.month.apply(lambda x: str(x).zfill(2))
-cutoffs.day = cutoffs.day.apply(lambda x: str(x).zfill(2))
+#only re-clean applications new or changed since the last run (state kept in state_dir)
+incremental = False
+state_dir = STATE_DIR
 
-#create date column
-cutoffs['date'] = cutoffs.apply(
-    lambda x: pd.to_datetime(f'{x.year}-{x.month}-{x.day}', format = '%Y-%m-%d'),
-    axis = 1,
-)
+#clean in memory ('memory') or streaming from disk, for samples larger than memory ('out_of_core')
+engine = 'memory'
 
 ##############################################################################
 #import CSI data
 ##############################################################################
 
-#declare columns to import
-cols = [
-        'Application Id',
-        'Utility',
-        'Application Status',
-        'App Received Date',
-        'App Complete Date',
-        'Self Installer',
-        'Installer Name',
-        'System Size DC',
-        'System Size AC',
-        'Inverter Quantity 1',
-        'Inverter Quantity 2',
-        'Inverter Quantity 3',
-        'Inverter Quantity 4',
-        'Inverter Quantity 5',
-        'Generator Quantity 1',
-        'Generator Quantity 2',
-        'Generator Quantity 3',
-        'Generator Quantity 4',
-        'Generator Quantity 5',
-
-    ]
-
-#declare how many rows to import (set to None if using all)
-rows = None
-
-#import select columns from SDGE
-data = pd.read_csv(
-    '../data/Interconnected_Project_Sites_2021-09-30/SDGE_Interconnected_Project_Sites_2021-09-30.csv',
-    usecols = cols,
-    nrows = rows,
-)
-
-#append SCE data
-data = data.append(
-    pd.read_csv(
-    '../data/Interconnected_Project_Sites_2021-09-30/SCE_Interconnected_Project_Sites_2021-09-30.csv',
-    usecols = cols,
-    nrows = rows,
-    ), 
-    ignore_index = True,
-)
-#append PCE data
-data = data.append(
-    pd.read_csv(
-    '../data/Interconnected_Project_Sites_2021-09-30/PGE_Interconnected_Project_Sites_2021-09-30.csv',
-    usecols = cols,
-    nrows = rows,
-    ), 
-    ignore_index = True,
-)
+def csi_path(iou):
+    return f'../data/Interconnected_Project_Sites_2021-09-30/{iou.upper()}_Interconnected_Project_Sites_2021-09-30.csv'
 
 ##############################################################################
 #Create main regression sample
 ##############################################################################
 
-#rename columns
-data = data.rename(
-    columns={
-        'Application Id': 'app_id',
-        'Utility': 'iou',
-        'Application Status': 'app_status',
-        'App Received Date': 'date_receive',
-        'App Complete Date': 'date_complete',
-        'Self Installer': 'self_install',
-        'Installer Name': 'installer',
-        'System Size DC':'size_dc',
-        'System Size AC': 'size_ac',
-        'Inverter Quantity 1': 'inv_q_1',
-        'Inverter Quantity 2': 'inv_q_2',
-        'Inverter Quantity 3': 'inv_q_3',
-        'Inverter Quantity 4': 'inv_q_4',
-        'Inverter Quantity 5': 'inv_q_5',
-        'Generator Quantity 1': 'gen_q_1',
-        'Generator Quantity 2': 'gen_q_2',
-        'Generator Quantity 3': 'gen_q_3',
-        'Generator Quantity 4': 'gen_q_4',
-        'Generator Quantity 5': 'gen_q_5',
-        }
-)
-
-#lower the case of iou
-data.iou = data.iou.str.lower()
-
-#convert dates to datetimes
-date_cols = [
-    'date_receive',
-    'date_complete',
-]
-for col in date_cols:
-    data[col] = pd.to_datetime(data[col])
-    
-#restrict sample to date range of cutoffs
-keep = []
-for iou in ['pge', 'sdge', 'sce']:
-    
-    iou_cutoffs = cutoffs.loc[cutoffs.iou == iou]
-    earliest = iou_cutoffs.date.min()
-    latest = iou_cutoffs.date.max()
-    index = data.loc[
-            (data.date_receive >= earliest) 
-            & (data.date_receive <= latest + pd.Timedelta(90, unit = 'day'))
-            & (data.iou == iou)
-    ].index
-    keep.append(index)
-keep_index = pd.Index(keep[0])
-keep_index = keep_index.union(keep[1])
-keep_index = keep_index.union(keep[2])
-data = data.loc[keep_index]
-
-#take out self installers
-data = data.loc[data.self_install == 'No']
-
-#add constant for regressions
-data['constant'] = 1
-
-#create subsidy column
-def find_subsidy(row):
-    u = row.iou
-    d = row.date_receive
-    
-    subsidy_df = cutoffs.loc[
-        (cutoffs.iou == u)
-        & (cutoffs.date <= d)
-    ]
-    
-    if subsidy_df.shape[0] == 0:
-        subsidy = 0
-    else:
-        subsidy = subsidy_df.sort_values('date', ascending = False).iloc[0].subsidyperwatt
-    
-    return subsidy
-
-data['subsidy'] = data.apply(
-    lambda x: find_subsidy(x),
-    axis = 1,
-)
-
-
-#create month-year columns for app_receive and app_complete
-data['month_year_receive'] = data.date_receive.to_numpy().astype('datetime64[M]')
-data['month_year_complete'] = data.date_complete.to_numpy().astype('datetime64[M]')
-
-#Aggregate inverter and generator quantities (still need to handle missing data being treated as 0)
-data['inv_q'] = data[['inv_q_1', 'inv_q_2', 'inv_q_3', 'inv_q_4', 'inv_q_5']].fillna(0).sum(axis=1)
-data['gen_q'] = data[['gen_q_1', 'gen_q_2', 'gen_q_3', 'gen_q_4', 'gen_q_5']].fillna(0).sum(axis=1)
-
-#replace 0 with NaN where applicable
-for col in ['inv', 'gen']:
-    sub_df = data[[f'{col}_q_1', f'{col}_q_2', f'{col}_q_3', f'{col}_q_4', f'{col}_q_5']]
-    
-    #Evaluate whether all entries in row are NaN
-    nan_test = np.all(sub_df.isna(), axis = 1)
-    all_nan_index = nan_test.loc[nan_test == True].index
-    
-    #change 0 to NaN according to index
-    data.loc[all_nan_index, f'{col}_q'] = np.nan
-    
-
-#output sample
 sample_cols = [
         'app_id',
         'iou',
         'app_status',
+        'date_receive',
         'date_complete',
         'self_install',
+        'installer',
         'size_dc',
         'gen_q',
         'month_year_receive',
@@ -217,101 +69,239 @@ sample_cols = [
         'subsidy',
     ]
 
-sample = data[sample_cols]
-sample.to_csv('sample.csv')
+def create_sample(data, cutoffs):
+    '''
+    returns the cleaned projects with subsidy, month-year and aggregate inverter
+    and generator quantity columns added
+    '''
+    #create subsidy column (as-of lookup of the latest cutoff on or before date_receive)
+    data['subsidy'] = find_subsidies(data, cutoffs)
+
+    #create month-year columns for app_receive and app_complete
+    data['month_year_receive'] = data.date_receive.to_numpy().astype('datetime64[M]')
+    data['month_year_complete'] = data.date_complete.to_numpy().astype('datetime64[M]')
+
+    #Aggregate inverter and generator quantities over every slot, NaN where all slots are missing
+    #(summed in float64, since totals can overflow the compact dtype of the quantities)
+    for col in ['inv_q', 'gen_q']:
+        totals = sum_present(data, slot_cols(data, col))
+        data[col] = smallest_int(pd.Series(totals, index = data.index))
+
+    return data
 
 ##############################################################################
 #create sample of IOU-month-years
 ##############################################################################
 
-ioumy = data[['iou', 'month_year_complete']].copy()
-ioumy.drop_duplicates(inplace = True)
-ioumy.dropna(inplace = True)
-ioumy.reset_index(inplace = True, drop = True)
+outcomes = [
+    'size_dc',
+    'gen_q',
+    'inv_q',
+]
 
+#groups of the installer panel
+panel_groups = ['installer', 'iou']
 
-#add constant for regressions
-ioumy['constant'] = 1
+def create_ioumy(data):
+    '''
+    returns one row per iou-month-year with a completed project, with the sum of each
+    outcome over projects completed in / concurrent with it (NaN where every value of
+    the outcome is NaN, since the sum would be zero otherwise)
+    '''
+    return format_ioumy(rollup_ioumy(data, outcomes))
 
 
-#find projects completed in IOU during month-year
-def find_completed_project_feature(row, feature):
+def create_installer_panel(sample):
     '''
-    returns a feature (column) of a sub dataset of the projects completed in an IOU at any point 
-    in a month-year.    
+    returns one row per installer-iou-month-year with a completed project, with the
+    columns of ioumy, from the cleaned sample
     '''
-    m_y = row.month_year_complete
-    iou = row.iou
-    
-    ref_df = data.loc[
-            (data.month_year_complete == m_y)
-            & (data.iou == iou)
-    ]
-    
-    return ref_df[feature]
-    
-    
-#find concurrent projects in IOU during month-year
-def find_concurrent_project_feature(row, feature):
+    sample = sample.assign(month_year_complete = sample.date_complete.to_numpy().astype('datetime64[M]'))
+
+    return format_ioumy(rollup_panel(sample, outcomes, panel_groups))
+
+
+def format_ioumy(ioumy):
     '''
-    returns a feature (column) of a sub dataset of the projects engaged in at any point 
-    in a month-year in an IOU. 
-    Note: completed projects are counted as concurrent projects
+    returns the output columns of ioumy from its rollup
     '''
-    m_y = row.month_year_complete
-    iou = row.iou
-    
-    ref_df = data.loc[
-            (data.month_year_complete >= m_y)
-            & (data.month_year_receive <= m_y)
-            & (data.iou == iou)
-    ]
-    
-    return ref_df[feature]
-    
-outcomes = [
-    'size_dc',
-    'gen_q',
-    'inv_q',
-]  
-
-for o in outcomes:
-    
-    #if any of outcome in iou-month-year obs is not NaN, set obs = (Sum of outcome in iou-month-year) , else set obs = NaN
-    #this is done becuase if all of outcome is NaN, sum will be zero instead of NaN otherwise
-    ioumy[f'{o}_complete'] = ioumy.apply(
-        lambda x: find_completed_project_feature(x, o).sum() if np.any(find_completed_project_feature(x, o).notna()) == True else np.nan,
-        axis = 1,
-    )
-    
-    ioumy[f'{o}_concurrent'] = ioumy.apply(
-        lambda x: find_concurrent_project_feature(x, o).sum() if np.any(find_concurrent_project_feature(x, o).notna()) == True else np.nan,
-        axis = 1,
+    ioumy = ioumy.copy()
+
+    ioumy = ioumy.rename(
+        columns = {
+            'month_year_complete': 'month_year',
+            'size_dc_complete': 'size_comp',
+            'size_dc_concurrent': 'size_conc',
+            'gen_q_complete': 'gen_q_comp',
+            'gen_q_concurrent': 'gen_q_conc',
+            'inv_q_complete': 'inv_q_comp',
+            'inv_q_concurrent': 'inv_q_conc',
+            },
     )
 
-ioumy = ioumy.rename(
-    columns = {
-        'month_year_complete': 'month_year',
-        'size_dc_complete': 'size_comp',
-        'size_dc_concurrent': 'size_conc',
-        'gen_q_complete': 'gen_q_comp',
-        'gen_q_concurrent': 'gen_q_conc',
-        'inv_q_complete': 'inv_q_comp',
-        'inv_q_concurrent': 'inv_q_conc',
-        },
-)
+    #create columns for total quantity of inverters and generators completed and concurrent
+    #(NaN unless both quantities are present, since NaN + x is NaN)
+    ioumy['q_comp'] = sum_present(ioumy, ['gen_q_comp', 'inv_q_comp'], min_count = 2)
+    ioumy['q_conc'] = sum_present(ioumy, ['gen_q_conc', 'inv_q_conc'], min_count = 2)
+
+    return ioumy
+
+##############################################################################
+#clean each IOU end to end and merge
+##############################################################################
+
+def clean_utility(iou, chunksize = chunksize, rows = rows):
+    '''
+    returns the (sample, ioumy) pair of a single IOU. IOUs share no data until the
+    final merge, so this can run in its own process.
+    '''
+    with stage('clean_utility', iou = iou) as rec:
+        cutoffs = load_cutoffs(iou)
+
+        #import select columns, rename them, lower the case of iou, convert dates, restrict
+        #sample to date range of cutoffs and take out self installers (chunk by chunk)
+        data = read_projects(
+            [csi_path(iou)],
+            cutoffs,
+            chunksize = chunksize,
+            nrows = rows,
+        )
+
+        with stage('create_sample', rows_in = data.shape[0], iou = iou):
+            data = create_sample(data, cutoffs)
+
+        with stage('create_ioumy', iou = iou, projects = data.shape[0]) as ioumy_rec:
+            ioumy = create_ioumy(data)
+            ioumy_rec['rows_out'] = ioumy.shape[0]
+
+        rec['rows_out'] = data.shape[0]
 
-#create columns for total quantity of inverters and generators completed and concurrent
-ioumy['q_comp'] = ioumy.apply(
-    lambda x: x.gen_q_comp + x.inv_q_comp if np.any(x[['gen_q_comp', 'inv_q_comp']].notna()) else np.nan,
-    axis = 1,
-)
-ioumy['q_conc'] = ioumy.apply(
-    lambda x: x.gen_q_conc + x.inv_q_conc if np.any(x[['gen_q_conc', 'inv_q_conc']].notna()) else np.nan,
-    axis = 1,
-)
+    return data[sample_cols], ioumy
+
+
+def clean_utility_incremental(iou, chunksize = chunksize, rows = rows, state_dir = state_dir):
+    '''
+    returns the (sample, ioumy) pair of a single IOU like clean_utility, but only
+    cleans applications that are new or changed since the state persisted in
+    state_dir by the last run, and only recomputes the iou-month-years they touch
+    '''
+    with stage('clean_utility_incremental', iou = iou) as rec:
+        cutoffs = load_cutoffs(iou)
+        cutoffs_digest = hash_frame(cutoffs)
+        state = load_state(iou, cutoffs_digest, state_dir)
+
+        #hash every raw row and clean only new or changed ones
+        hashes = []
+        changed = []
+        for chunk in read_raw(csi_path(iou), chunksize, rows):
+            chunk_hashes = pd.DataFrame({
+                'app_id': chunk['Application Id'].to_numpy(),
+                'hash': hash_rows(chunk),
+                'pos': chunk.index,
+            })
+            if state is None:
+                keep = np.ones(chunk.shape[0], dtype = bool)
+            else:
+                keep = ~unchanged_rows(chunk_hashes, state['hashes'])
+            hashes.append(chunk_hashes)
+            changed.append(clean_projects(chunk.loc[keep], cutoffs))
+
+        hashes = pd.concat(hashes, ignore_index = True)
+        if hashes.app_id.duplicated().any():
+            raise ValueError(f'Application Id is not unique in {csi_path(iou)}')
+
+        changed = create_sample(concat_projects(changed), cutoffs)
+
+        if state is None:
+            data = changed
+            ioumy = rollup_ioumy(data, outcomes)
+        else:
+            #carry over unchanged projects, re-indexed to their row in the new snapshot
+            unchanged_ids = hashes.app_id.loc[unchanged_rows(hashes, state['hashes'])]
+            old_data = state['data']
+            is_unchanged = old_data.app_id.isin(unchanged_ids)
+            kept = old_data.loc[is_unchanged]
+            kept.index = kept.app_id.map(hashes.set_index('app_id').pos).to_numpy()
+            data = concat_projects([kept, changed]).sort_index()
+
+            #cells touched by new, changed or removed projects (old and new versions)
+            ioumy = ioumy_keys(data)
+            ioumy = ioumy.merge(
+                state['ioumy'],
+                on = ['iou', 'month_year_complete'],
+                how = 'left',
+                indicator = True,
+            )
+            versions = concat_projects([old_data.loc[~is_unchanged], changed])
+            affected = affected_cells(ioumy, versions)
+
+            #cells that did not exist before must be computed as well
+            affected |= (ioumy.pop('_merge') == 'left_only').to_numpy()
+            if affected.any():
+                recomputed = rollup_ioumy(data, outcomes, cells = ioumy.loc[affected])
+                ioumy.loc[affected, recomputed.columns] = recomputed.to_numpy()
+
+        save_state(iou, cutoffs_digest, hashes, data, ioumy, state_dir)
+
+        rec['rows_out'] = data.shape[0]
+        rec['rows_changed'] = changed.shape[0]
+
+    return data[sample_cols], format_ioumy(ioumy)
+
+
+def clean(ious = ious, processes = processes, chunksize = chunksize, rows = rows,
+          incremental = incremental, state_dir = state_dir):
+    '''
+    returns the (sample, ioumy) pair of all IOUs, concatenated in the order of ious
+    whether or not they were cleaned in parallel
+    '''
+    #settings go to the workers as arguments: spawned processes re-import this
+    #module and would not see module globals changed after import (e.g. by cli.py)
+    if incremental:
+        clean_one = functools.partial(clean_utility_incremental, chunksize = chunksize, rows = rows, state_dir = state_dir)
+    else:
+        clean_one = functools.partial(clean_utility, chunksize = chunksize, rows = rows)
+
+    with stage('clean', processes = processes, incremental = incremental) as rec:
+        if processes > 1:
+            with ProcessPoolExecutor(max_workers = min(processes, len(ious))) as pool:
+                results = list(pool.map(clean_one, ious))
+        else:
+            results = [clean_one(iou) for iou in ious]
+
+        sample = concat_projects([r[0] for r in results]).reset_index(drop = True)
+        ioumy = pd.concat([r[1] for r in results], ignore_index = True)
+        rec['rows_out'] = sample.shape[0]
+
+    return sample, ioumy
+
+
+def main(engine = engine):
+    '''
+    cleans all IOUs and writes the sample, ioumy and installer panel
+    '''
+    if engine == 'out_of_core':
+        #writes sample, ioumy and installer panel itself, without holding the
+        #sample in memory
+        from out_of_core import clean as clean_out_of_core
+        clean_out_of_core(ious, processes, chunksize = chunksize, rows = rows)
+
+    else:
+        sample, ioumy = clean(
+            ious,
+            processes,
+            chunksize = chunksize,
+            rows = rows,
+            incremental = incremental,
+            state_dir = state_dir,
+        )
 
-ioumy.to_csv('ioumy.csv')
+        #output sample, ioumy and installer panel
+        write_sample(sample)
+        write_ioumy(ioumy)
+        write_panel(create_installer_panel(sample))
 
 
+if __name__ == '__main__':
 
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Jumps in applications around the subsidy step-downs.
+
+For every cutoff date and bandwidth of k days, the applications received in
+the k days before the cutoff are compared with those received in the k days
+from the cutoff on (an application received on a cutoff date already gets the
+lower subsidy): the jump in applications per day, and in the mean of each
+outcome (size_dc, gen_q).
+
+The sample is sorted by receive date once per IOU, with running sums (count,
+sum and sum of squares) of each outcome over the sorted rows. The window of
+every cutoff x bandwidth pair is then found with two binary searches, and its
+totals are differences of running sums, so all pairs are estimated at once
+without masking the sample for any of them.
+
+The sample only holds applications received from the first cutoff of an IOU
+to trailing_days after its last (ingest.window_bounds). A window reaching
+outside that range would count the missing days as a drop in applications,
+so its side of the jump is NaN, with the observations it does hold still
+reported.
+"""
+
+import pandas as pd
+import numpy as np
+
+from schedule import load_cutoffs
+from subsidy import index_cutoffs
+from ingest import window_bounds
+from storage import read_sample
+from instrument import stage
+
+#declare IOUs, outcomes and bandwidths (in days) of the windows around each cutoff
+ious = ['pge', 'sce', 'sdge']
+outcomes = ['size_dc', 'gen_q']
+bandwidths = [7, 14, 30, 60, 90]
+
+
+class DateIndex:
+
+    def __init__(self, sample, outcomes = outcomes, date = 'date_receive', group = 'iou'):
+        '''
+        sorts the rows of sample by date within each group and takes the running
+        count, sum and sum of squares of each outcome
+        '''
+        self.outcomes = list(outcomes)
+        self.groups = {}
+
+        days = sample[date].to_numpy().astype('datetime64[D]')
+        labels = sample[group].to_numpy(dtype = object)
+        values = sample[self.outcomes].to_numpy(dtype = 'float64', na_value = np.nan)
+
+        keep = ~np.isnat(days)
+        for g in pd.unique(labels[keep]):
+            rows = np.flatnonzero(keep & (labels == g))
+            rows = rows[np.argsort(days[rows], kind = 'mergesort')]
+
+            #centered on the group means, so sums of squares keep their precision
+            x = values[rows]
+            present = ~np.isnan(x)
+            center = np.nanmean(x, axis = 0) if present.any() else np.zeros(x.shape[1])
+            center = np.where(np.isnan(center), 0, center)
+            x = np.where(present, x - center, 0)
+
+            self.groups[g] = {
+                'days': days[rows],
+                'center': center,
+                'count': running(present.astype('float64')),
+                'sum': running(x),
+                'sumsq': running(x ** 2),
+            }
+
+    def windows(self, g, lo, hi):
+        '''
+        returns the (start, stop) positions of the rows of group g with
+        lo <= date < hi, for arrays of datetime64[D] bounds
+        '''
+        days = self.groups[g]['days']
+
+        return np.searchsorted(days, lo, side = 'left'), np.searchsorted(days, hi, side = 'left')
+
+    def totals(self, g, start, stop):
+        '''
+        returns the rows, and the count, mean and variance (ddof 1) of each
+        outcome, of the rows [start, stop) of group g
+        '''
+        index = self.groups[g]
+        count = index['count'][stop] - index['count'][start]
+        total = index['sum'][stop] - index['sum'][start]
+        sumsq = index['sumsq'][stop] - index['sumsq'][start]
+
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            mean = total / count
+            var = (sumsq - count * mean ** 2) / (count - 1)
+
+        return stop - start, count, mean + index['center'], np.maximum(var, 0)
+
+
+def running(values):
+    '''
+    returns the running sums of the rows of values, with a leading zero row
+    '''
+    out = np.zeros((values.shape[0] + 1,) + values.shape[1:])
+    np.cumsum(values, axis = 0, out = out[1:])
+
+    return out
+
+
+def cutoff_jumps(index, cutoffs, bandwidths = bandwidths, trailing_days = 90):
+    '''
+    returns the jump at every cutoff (a dataframe of iou, date and
+    subsidyperwatt) for every bandwidth in days, in applications per day and in
+    the mean of each outcome of the index, with standard errors (Poisson for
+    applications, unequal variances for means) and the observations on each
+    side. Sides of windows reaching outside the sample window of the cutoffs
+    (with trailing_days as in cleaning) are NaN, as is their jump.
+    '''
+    bandwidths = np.asarray(bandwidths, dtype = 'int64')
+    bounds = window_bounds(cutoffs, trailing_days)
+    frames = []
+    for g, (dates, subsidies) in index_cutoffs(cutoffs).items():
+        if g not in index.groups:
+            continue
+
+        #every cutoff x bandwidth pair at once
+        days = dates.astype('datetime64[D]')
+        cutoff = np.repeat(days, bandwidths.size)
+        k = np.tile(bandwidths, days.size)
+        before = index.windows(g, cutoff - k, cutoff)
+        after = index.windows(g, cutoff, cutoff + k)
+        rows_b, count_b, mean_b, var_b = index.totals(g, *before)
+        rows_a, count_a, mean_a, var_a = index.totals(g, *after)
+
+        #NaN for sides not wholly inside the sample window, 1 otherwise
+        earliest, latest = bounds.loc[g, ['earliest', 'latest']].to_numpy().astype('datetime64[D]')
+        full_b = np.where(cutoff - k >= earliest, 1, np.nan)
+        full_a = np.where(cutoff + k <= latest + 1, 1, np.nan)
+
+        #subsidy per watt in effect before and from each cutoff
+        previous = np.concatenate([[np.nan], subsidies[:-1]])
+        keys = {
+            'iou': g,
+            'cutoff': cutoff.astype('datetime64[ns]'),
+            'subsidy_before': np.repeat(previous, bandwidths.size),
+            'subsidy_after': np.repeat(subsidies, bandwidths.size),
+            'bandwidth': k,
+        }
+
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            frames.append(pd.DataFrame({
+                **keys,
+                'outcome': 'applications',
+                'before': rows_b / k * full_b,
+                'after': rows_a / k * full_a,
+                'jump': (rows_a - rows_b) / k * full_b * full_a,
+                'se': np.sqrt(rows_a + rows_b) / k * full_b * full_a,
+                'n_before': rows_b,
+                'n_after': rows_a,
+            }))
+            for j, o in enumerate(index.outcomes):
+                frames.append(pd.DataFrame({
+                    **keys,
+                    'outcome': o,
+                    'before': mean_b[:, j] * full_b,
+                    'after': mean_a[:, j] * full_a,
+                    'jump': (mean_a[:, j] - mean_b[:, j]) * full_b * full_a,
+                    'se': np.sqrt(var_a[:, j] / count_a[:, j] + var_b[:, j] / count_b[:, j]) * full_b * full_a,
+                    'n_before': count_b[:, j].astype('int64'),
+                    'n_after': count_a[:, j].astype('int64'),
+                }))
+
+    jumps = pd.concat(frames, ignore_index = True)
+
+    return jumps.sort_values(['outcome', 'iou', 'cutoff', 'bandwidth'], kind = 'mergesort', ignore_index = True)
+
+
+def main(path = 'cutoff_jumps.csv'):
+    '''
+    estimates the jumps around every cutoff of every IOU and writes them to path
+    '''
+    sample = read_sample(columns = ['iou', 'date_receive'] + outcomes)
+    cutoffs = pd.concat([load_cutoffs(iou) for iou in ious], ignore_index = True)
+
+    with stage('cutoff_jumps', rows_in = sample.shape[0], bandwidths = len(bandwidths)) as rec:
+        jumps = cutoff_jumps(DateIndex(sample), cutoffs, bandwidths = bandwidths)
+        rec['rows_out'] = jumps.shape[0]
+
+    jumps.to_csv(path, index = False)
+    print(jumps.loc[jumps.bandwidth == max(bandwidths)])
+
+    return jumps
+
+
+if __name__ == '__main__':
+
+    main()
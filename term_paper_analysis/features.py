@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Regressors of the subsidy regressions, built in one pass.
+
+Month, year and the numeric time trend are read off datetime64 arrays with
+integer arithmetic instead of per-row Python calls. Categorical features are
+encoded as integer codes against levels cached to disk, so a level keeps its
+code across runs and refreshes (new levels are appended, never renumbered).
+Regressors (and fixed-effect dummies, when they are needed at all) are
+written straight into one preallocated float64 array.
+"""
+
+import os
+import json
+
+import pandas as pd
+import numpy as np
+
+LEVELS_PATH = 'design_levels.json'
+
+#nanoseconds per unit of the time trend (myr_value)
+TREND_UNIT = 10000000000
+
+
+def time_features(dates):
+    '''
+    returns the month (1-12), year and time trend (nanoseconds since the epoch
+    / TREND_UNIT) of each of dates, as float64 arrays with NaN where a date is
+    missing
+    '''
+    dates = np.asarray(dates, dtype = 'datetime64[ns]')
+    missing = np.isnat(dates)
+    months = dates.astype('datetime64[M]').astype('int64')
+
+    month = (months % 12 + 1).astype('float64')
+    year = (months // 12 + 1970).astype('float64')
+    trend = dates.astype('int64') / TREND_UNIT
+    for values in (month, year, trend):
+        values[missing] = np.nan
+
+    return month, year, trend
+
+
+class Levels:
+
+    def __init__(self, path = LEVELS_PATH):
+        '''
+        levels of each categorical feature, loaded from path if it exists
+        '''
+        self.path = path
+        self.levels = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.levels = json.load(f)
+        self.changed = False
+
+    def encode(self, name, values):
+        '''
+        returns the integer codes of values among the levels of feature name
+        (-1 where a value is missing), adding unseen values as new levels
+        '''
+        values = pd.Series(values)
+        missing = values.isna().to_numpy()
+        uniques, inverse = np.unique(values[~missing].to_numpy(), return_inverse = True)
+
+        #levels are stored as strings, so they survive the JSON round trip
+        levels = self.levels.setdefault(name, [])
+        index = {level: code for code, level in enumerate(levels)}
+        for u in map(str, uniques):
+            if u not in index:
+                index[u] = len(levels)
+                levels.append(u)
+                self.changed = True
+
+        codes = np.full(values.shape[0], -1, dtype = 'int64')
+        codes[~missing] = np.array([index[str(u)] for u in uniques], dtype = 'int64')[inverse]
+
+        return codes
+
+    def save(self):
+        '''
+        writes the levels to path if any were added
+        '''
+        if self.path is None or not self.changed:
+            return
+        with open(self.path, 'w') as f:
+            json.dump(self.levels, f, indent = 1)
+        self.changed = False
+
+
+def design_matrix(df, cols, out = None):
+    '''
+    returns the (n, len(cols)) float64 matrix of the columns cols of df,
+    written column by column into out (preallocated if not given)
+    '''
+    if out is None:
+        out = np.empty((df.shape[0], len(cols)))
+    for j, col in enumerate(cols):
+        out[:, j] = df[col].to_numpy('float64', na_value = np.nan)
+
+    return out
+
+
+def build_design(df, endog, exog, fe = ()):
+    '''
+    returns (y, X) for the regression of endog on exog and dummies of the
+    integer-coded columns in fe (each without its first level), with X one
+    preallocated dense array. Only levels with rows in df get a column, so
+    cached codes absent from df never leave empty or collinear columns.
+    '''
+    y = df[endog].to_numpy('float64', na_value = np.nan)
+    codes = [np.unique(df[f].to_numpy('int64'), return_inverse = True)[1] for f in fe]
+
+    k = len(exog)
+    widths = [c.max(initial = 0) for c in codes]
+    X = np.zeros((df.shape[0], k + sum(widths)))
+    design_matrix(df, exog, out = X[:, :k])
+
+    #one column per level but the first, set where the row has that level
+    offset = k
+    for c, width in zip(codes, widths):
+        rows = np.flatnonzero(c > 0)
+        X[rows, offset + c[rows] - 1] = 1
+        offset += width
+
+    return y, X
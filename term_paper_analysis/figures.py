@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Rendering of the paper's figures from plot specs.
+
+A plot spec is a dict holding the data slice to draw and everything needed to
+draw it (kind, columns, axes limits, labels, title, output path). Specs with a
+path are saved, optionally across a process pool whose workers draw on the
+headless Agg backend; specs without one are drawn in the calling process, on
+its own backend, and shown. Every figure is closed as soon as it is saved or
+shown, and very large scatter series can be downsampled before drawing.
+
+Spec keys:
+    kind        'fit' (scatter of y on x plus the fitted line) or
+                'hist' (scatter of y on x over a histogram of x)
+    data        dataframe with the columns to draw
+    x, y        columns to draw
+    fitted      column of fitted values ('fit' only)
+    bins        histogram bins ('hist' only)
+    color       scatter/histogram color ('hist' only)
+    path        where to save the figure; specs without a path are shown
+    figsize, title, xlabel, ylabel, xlim, ylim, aspect (all optional)
+    max_points  draw at most this many scatter points (optional)
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+
+def downsample(data, max_points, seed = 0):
+    '''
+    returns at most max_points rows of data, sampled uniformly with a fixed seed
+    and kept in their original order
+    '''
+    if max_points is None or data.shape[0] <= max_points:
+        return data
+
+    return data.sample(n = max_points, random_state = seed).sort_index()
+
+
+def use_agg():
+    '''
+    selects the headless Agg backend, in each worker process of render_all
+    '''
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def render(spec):
+    '''
+    draws a plot spec, saves it (or shows it if it has no path) and closes the
+    figure. Returns the saved path, or None for specs without a path.
+    '''
+    from matplotlib import pyplot as plt
+
+    data = spec['data']
+    points = downsample(data, spec.get('max_points'))
+
+    fig, ax = plt.subplots(figsize = spec.get('figsize', (8,6)))
+    try:
+        if spec['kind'] == 'fit':
+            points.plot(
+                x = spec['x'],
+                y = spec['y'],
+                kind = 'scatter',
+                ax = ax,
+            )
+            #the fitted line is cheap, so it is always drawn from every point
+            data.plot(
+                x = spec['x'],
+                y = spec['fitted'],
+                kind = 'line',
+                ax = ax,
+                color='red',
+                legend = False,
+            )
+        elif spec['kind'] == 'hist':
+            points.plot(
+                x = spec['x'],
+                y = spec['y'],
+                kind = 'scatter',
+                ax = ax,
+                color = spec.get('color'),
+            )
+            data[spec['x']].hist(
+                bins = spec['bins'],
+                ax = ax,
+                alpha = 0.5,
+                color = spec.get('color'),
+            )
+        else:
+            raise ValueError(f"unknown plot kind {spec['kind']}")
+
+        if 'ylabel' in spec:
+            ax.set_ylabel(spec['ylabel'])
+        if 'xlabel' in spec:
+            ax.set_xlabel(spec['xlabel'])
+        if 'title' in spec:
+            ax.set_title(spec['title'])
+        if 'aspect' in spec:
+            ax.set_aspect(spec['aspect'])
+        if 'xlim' in spec:
+            ax.set_xlim(*spec['xlim'])
+        if 'ylim' in spec:
+            ax.set_ylim(*spec['ylim'])
+
+        if spec.get('path') is None:
+            plt.show()
+        else:
+            fig.savefig(spec['path'])
+    finally:
+        plt.close(fig)
+
+    return spec.get('path')
+
+
+def render_all(specs, processes = 4):
+    '''
+    renders every plot spec and returns the saved paths (None for specs shown)
+    in the order of specs. Specs with a path are saved across a process pool of
+    Agg workers; specs without one are drawn here, so they can be displayed.
+    '''
+    paths = [None] * len(specs)
+
+    #only specs to save go to the pool, which is not worth starting for one
+    pooled = [i for i, s in enumerate(specs) if s.get('path') is not None]
+    if processes <= 1 or len(pooled) <= 1:
+        pooled = []
+    if pooled:
+        with ProcessPoolExecutor(max_workers = min(processes, len(pooled)), initializer = use_agg) as pool:
+            for i, path in zip(pooled, pool.map(render, [specs[i] for i in pooled])):
+                paths[i] = path
+
+    pooled = set(pooled)
+    for i, spec in enumerate(specs):
+        if i not in pooled:
+            paths[i] = render(spec)
+
+    return paths
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+OLS with absorbed fixed effects.
+
+Fixed effects are never materialized as dummies. Each variable is demeaned
+within every fixed-effect level in turn (alternating projections) until it
+stops changing, using integer level codes and np.bincount, so the cost is
+O(n) per sweep whatever the number of levels. By the Frisch-Waugh-Lovell
+theorem the coefficients on the remaining regressors equal those of the
+dummy regression, and the residual degrees of freedom are corrected for the
+absorbed levels so the standard errors match as well.
+"""
+
+import types
+import warnings
+
+import pandas as pd
+import numpy as np
+
+from features import design_matrix
+
+
+def absorb(values, codes, tol = 1e-10, maxiter = 1000):
+    '''
+    returns (values, iterations): values (n x k) with the means within the
+    levels of every code array in codes projected out, and the number of
+    sweeps taken. Warns if the sweeps have not converged within maxiter.
+    '''
+    values = np.array(values, dtype = 'float64')
+    #levels without rows (cached codes absent from this sample) are never read
+    counts = [np.maximum(np.bincount(c), 1) for c in codes]
+    scale = np.maximum(np.abs(values).max(axis = 0), 1)
+
+    for iterations in range(1, maxiter + 1):
+        before = values.copy()
+        for c, n in zip(codes, counts):
+            for j in range(values.shape[1]):
+                values[:, j] -= (np.bincount(c, weights = values[:, j]) / n)[c]
+
+        #a single set of fixed effects is absorbed exactly in one sweep
+        change = 0 if len(codes) == 1 else (np.abs(values - before).max(axis = 0) / scale).max()
+        if change < tol:
+            break
+    else:
+        warnings.warn(
+            f'fixed effects not absorbed after {maxiter} iterations '
+            f'(relative change {change:.2e}, tolerance {tol:.0e})',
+            RuntimeWarning,
+            stacklevel = 2,
+        )
+
+    return values, iterations
+
+
+def absorbed_rank(codes):
+    '''
+    returns the number of parameters absorbed by the fixed effects: the
+    levels of each set, less the redundancies between them (exact for one or
+    two sets, via the connected components of the two sets of levels). Codes
+    need not be contiguous: levels without rows are not counted.
+    '''
+    levels = [c.max() + 1 for c in codes]
+    present = [np.unique(c).size for c in codes]
+    if len(codes) == 1:
+        return present[0]
+    if len(codes) > 2:
+        return sum(present) - (len(codes) - 1)
+
+    #union-find over the bipartite graph of observed level pairs
+    parent = list(range(levels[0] + levels[1]))
+
+    def find(a):
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        return a
+
+    pairs = np.unique(np.stack([codes[0], codes[1] + levels[0]], axis = 1), axis = 0)
+    for a, b in pairs:
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[ra] = rb
+    components = len({find(a) for a in range(len(parent))})
+
+    #a level without rows is its own component, so it cancels out
+    return levels[0] + levels[1] - components
+
+
+class FEResults:
+    '''
+    results of fit_fe, exposing the attributes summary_col reads from
+    statsmodels results (params, bse, tvalues, pvalues, conf_int, nobs,
+    rsquared, rsquared_adj, model.endog_names/exog_names), and the number of
+    iterations taken to absorb the fixed effects
+    '''
+
+    def __init__(self, endog, exog, params, bse, nobs, df_resid, rsquared, iterations = 1):
+        from scipy import stats
+
+        self.params = pd.Series(params, index = exog)
+        self.bse = pd.Series(bse, index = exog)
+        self.tvalues = self.params / self.bse
+        self.pvalues = pd.Series(
+            2 * stats.t.sf(np.abs(self.tvalues), df_resid),
+            index = exog,
+        )
+        self.nobs = nobs
+        self.df_resid = df_resid
+        self.rsquared = rsquared
+        self.rsquared_adj = 1 - (1 - rsquared) * (nobs - 1) / df_resid
+        self.iterations = iterations
+        self.model = types.SimpleNamespace(
+            endog_names = endog,
+            exog_names = list(exog),
+            data = types.SimpleNamespace(param_names = list(exog)),
+        )
+
+    def conf_int(self, alpha = .05):
+        from scipy import stats
+
+        q = stats.t.ppf(1 - alpha / 2, self.df_resid)
+
+        return pd.DataFrame({
+            0: self.params - q * self.bse,
+            1: self.params + q * self.bse,
+        })
+
+
+def within_design(df, endog, exog, fe, tol = 1e-10):
+    '''
+    returns (y, X, codes, iterations): endog and exog of df with the fixed
+    effects for every column in fe absorbed, the integer level codes of each fe
+    column and the iterations absorb took. Integer fe columns (such as codes
+    from features.Levels) are used as they are, other columns are factorized.
+    '''
+    codes = [
+        df[f].to_numpy('int64') if pd.api.types.is_integer_dtype(df[f]) else pd.factorize(df[f])[0]
+        for f in fe
+    ]
+    values = design_matrix(df, [endog] + list(exog))
+    within, iterations = absorb(values, codes, tol)
+
+    return within[:, 0], within[:, 1:], codes, iterations
+
+
+def fit_fe(df, endog, exog, fe, tol = 1e-10):
+    '''
+    fits OLS of endog on exog with a constant and fixed effects for every
+    column in fe absorbed. Returns an FEResults with the coefficients on exog,
+    their classical standard errors and the R-squared of the equivalent dummy
+    regression.
+    '''
+    y = df[endog].to_numpy('float64')
+    y_w, X_w, codes, iterations = within_design(df, endog, exog, fe, tol)
+
+    params = np.linalg.lstsq(X_w, y_w, rcond = None)[0]
+    resid = y_w - X_w @ params
+
+    nobs = y.shape[0]
+    df_resid = nobs - len(exog) - absorbed_rank(codes)
+    ssr = resid @ resid
+    bse = np.sqrt(ssr / df_resid * np.diag(np.linalg.pinv(X_w.T @ X_w)))
+    rsquared = 1 - ssr / ((y - y.mean()) ** 2).sum()
+
+    return FEResults(endog, exog, params, bse, nobs, df_resid, rsquared, iterations)
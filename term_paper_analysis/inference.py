@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Resampling inference for the subsidy elasticity.
+
+The cluster (block) bootstrap works from per-cluster sufficient statistics:
+X'X and X'y of the full design, fixed-effect dummies included, are computed
+once per cluster, and a replicate is a multinomial reweighting of the
+clusters, so its cost is O(clusters x k^2) instead of a refit from raw rows.
+Every replicate re-estimates the fixed effects along with the other
+coefficients, exactly as a refit on the resampled rows would. Absorbing them
+once on the full sample instead would understate the standard errors.
+Replicates run in chunks across a process pool, each chunk with its own seed,
+and finished chunks are checkpointed to disk so an interrupted run resumes
+where it stopped.
+
+Placebo tests shift every cutoff date in the schedule, reassign subsidies
+and refit, one shift per task.
+"""
+
+import os
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import numpy as np
+
+from subsidy import find_subsidies
+from fixed_effects import fit_fe
+from ols import group_crossprod
+
+
+def cluster_stats(y, X, clusters):
+    '''
+    returns (XtX, Xty) per cluster, of shapes (C, k, k) and (C, k)
+    '''
+    codes = pd.factorize(clusters)[0]
+
+    return group_crossprod(codes, X, codes.max() + 1, y = y)
+
+
+def bootstrap_chunk(XtX, Xty, reps, seed):
+    '''
+    returns (reps, k) coefficients of cluster bootstrap replicates drawn with seed
+    '''
+    rng = np.random.default_rng(seed)
+    n_clusters = XtX.shape[0]
+    weights = rng.multinomial(n_clusters, np.full(n_clusters, 1 / n_clusters), size = reps)
+
+    XtX_b = np.einsum('rc,ckl->rkl', weights, XtX)
+    Xty_b = np.einsum('rc,ck->rk', weights, Xty)
+
+    return np.einsum('rkl,rl->rk', np.linalg.pinv(XtX_b), Xty_b)
+
+
+def cluster_bootstrap(y, X, clusters, reps = 10000, chunk = 500, processes = 4,
+                      seed = 0, checkpoint_dir = None):
+    '''
+    returns (reps, k) cluster bootstrap coefficients of the OLS of y on X,
+    resampling whole clusters with replacement. X is the full design (with
+    the constant and any fixed-effect dummies). If checkpoint_dir is given,
+    each finished chunk is saved there and reused by later calls with the
+    same data, seed and chunk size.
+    '''
+    XtX, Xty = cluster_stats(y, X, clusters)
+
+    #solve on unit-norm columns, so pinv does not mistake small dummy columns
+    #next to the time trend for redundant ones
+    scale = np.sqrt(np.diagonal(XtX.sum(axis = 0)))
+    scale[scale == 0] = 1
+    XtX = XtX / np.outer(scale, scale)
+    Xty = Xty / scale
+
+    sizes = [min(chunk, reps - start) for start in range(0, reps, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    #checkpoints are only reused for the same data and draws, including the
+    #size of the chunk (the last one is smaller when chunk does not divide reps)
+    digest = hashlib.sha1(XtX.tobytes() + Xty.tobytes()).hexdigest()[:12]
+
+    def chunk_path(i):
+        return os.path.join(checkpoint_dir, f'bootstrap_{digest}_{seed}_{chunk}_{i}_{sizes[i]}.npy')
+
+    results = [None] * len(sizes)
+    todo = []
+    for i in range(len(sizes)):
+        if checkpoint_dir is not None and os.path.exists(chunk_path(i)):
+            results[i] = np.load(chunk_path(i))
+        else:
+            todo.append(i)
+
+    if checkpoint_dir is not None:
+        os.makedirs(checkpoint_dir, exist_ok = True)
+
+    with ProcessPoolExecutor(max_workers = processes) as pool:
+        futures = {
+            i: pool.submit(bootstrap_chunk, XtX, Xty, sizes[i], seeds[i])
+            for i in todo
+        }
+        for i, future in futures.items():
+            results[i] = future.result()
+            if checkpoint_dir is not None:
+                np.save(chunk_path(i), results[i])
+
+    return np.concatenate(results) / scale
+
+
+def bootstrap_ci(coefs, names, alpha = .05):
+    '''
+    returns the bootstrap standard error and percentile confidence interval
+    of each coefficient
+    '''
+    return pd.DataFrame({
+        'se': coefs.std(axis = 0, ddof = 1),
+        'lower': np.quantile(coefs, alpha / 2, axis = 0),
+        'upper': np.quantile(coefs, 1 - alpha / 2, axis = 0),
+    }, index = names)
+
+
+def placebo_fit(sample, cutoffs, shift, endog, exog, fe):
+    '''
+    returns the log_subsidy coefficient and standard error with every cutoff
+    date shifted by shift days. Projects received before the first shifted
+    cutoff have no subsidy and are left out.
+    '''
+    shifted = cutoffs.assign(date = cutoffs.date + pd.Timedelta(shift, unit = 'day'))
+    sample = sample.assign(subsidy = find_subsidies(sample, shifted).to_numpy())
+    sample = sample.loc[sample.subsidy > 0]
+    sample = sample.assign(log_subsidy = np.log(sample.subsidy))
+
+    res = fit_fe(sample, endog, exog, fe)
+
+    return {
+        'shift': shift,
+        'coef': res.params['log_subsidy'],
+        'se': res.bse['log_subsidy'],
+        'nobs': res.nobs,
+    }
+
+
+def placebo_cutoffs(sample, cutoffs, shifts, endog, exog, fe, processes = 4):
+    '''
+    returns one row per shift (in days) of the cutoff dates with the placebo
+    log_subsidy coefficient, fitted across a process pool. sample needs iou and
+    date_receive columns to reassign subsidies.
+    '''
+    with ProcessPoolExecutor(max_workers = processes) as pool:
+        futures = [
+            pool.submit(placebo_fit, sample, cutoffs, shift, endog, exog, fe)
+            for shift in shifts
+        ]
+        rows = [f.result() for f in futures]
+
+    return pd.DataFrame(rows)
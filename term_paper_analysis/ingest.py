@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ingest of the CSI Interconnected Project Sites files.
+
+Each file can be streamed in fixed-size chunks. Renaming, IOU lower-casing,
+date parsing, the cutoff date-window filter and the self-installer filter are
+applied chunk by chunk, so only surviving rows are kept in memory and peak
+memory is bounded by the chunk size rather than by the size of the file.
+
+Surviving rows are kept compact: low-cardinality strings (and installer names)
+are categoricals and equipment quantities use the smallest nullable integer
+dtype that holds them. Chunks are concatenated with concat_projects, which
+unions their categories so the categoricals survive the concat.
+"""
+
+import re
+
+import pandas as pd
+import numpy as np
+
+from instrument import stage
+
+#columns to import and their names in the cleaned data
+columns = {
+    'Application Id': 'app_id',
+    'Utility': 'iou',
+    'Application Status': 'app_status',
+    'App Received Date': 'date_receive',
+    'App Complete Date': 'date_complete',
+    'Self Installer': 'self_install',
+    'Installer Name': 'installer',
+    'System Size DC':'size_dc',
+    'System Size AC': 'size_ac',
+}
+
+#equipment slot columns ('Inverter Quantity 1', ...) and their names in the
+#cleaned data ('inv_q_1', ...). Every numbered slot in a file is imported, since
+#newer exports have more than five.
+slots = {
+    'Inverter Quantity': 'inv_q',
+    'Generator Quantity': 'gen_q',
+}
+
+date_cols = [
+    'date_receive',
+    'date_complete',
+]
+
+#string columns stored as categoricals (dictionary-encoded)
+category_cols = [
+    'iou',
+    'app_status',
+    'self_install',
+    'installer',
+]
+
+
+
+def column_name(raw):
+    '''
+    returns the name in the cleaned data of a raw column, or None if it is not
+    imported
+    '''
+    if raw in columns:
+        return columns[raw]
+    for prefix, name in slots.items():
+        match = re.fullmatch(f'{prefix} ([0-9]+)', raw)
+        if match:
+            return f'{name}_{match.group(1)}'
+
+    return None
+
+
+def slot_cols(data, name):
+    '''
+    returns the slot columns of an equipment quantity (e.g. 'inv_q') in data,
+    in slot order
+    '''
+    cols = [c for c in data.columns if re.fullmatch(f'{name}_[0-9]+', c)]
+
+    return sorted(cols, key = lambda c: int(c.rsplit('_', 1)[1]))
+
+
+def smallest_int(values):
+    '''
+    returns values as the smallest nullable integer dtype that holds them, or
+    unchanged if any value is not a whole number or they exceed the Int64 range
+    '''
+    present = values.dropna()
+    if not present.empty and (present != np.floor(present)).any():
+        return values
+
+    lo = present.min() if not present.empty else 0
+    hi = present.max() if not present.empty else 0
+    for dtype in ['Int8', 'Int16', 'Int32', 'Int64']:
+        info = np.iinfo(dtype.lower())
+        if info.min <= lo and hi <= info.max:
+            return values.astype(dtype)
+
+    return values
+
+
+def compact(data):
+    '''
+    returns data with categorical strings and downcast quantities
+    '''
+    data = data.copy()
+    for col in category_cols:
+        if col in data:
+            data[col] = data[col].astype('category')
+    for name in slots.values():
+        for col in slot_cols(data, name):
+            data[col] = smallest_int(data[col])
+
+    return data
+
+
+def concat_projects(frames):
+    '''
+    returns frames concatenated, with the categories of every categorical column
+    unioned first (pandas falls back to object strings otherwise)
+    '''
+    frames = list(frames)
+    for col in category_cols:
+        if col not in frames[0]:
+            continue
+        cats = set()
+        for f in frames:
+            cats.update(f[col].dropna().unique())
+        dtype = pd.CategoricalDtype(sorted(cats))
+        frames = [f.astype({col: dtype}) for f in frames]
+
+    return pd.concat(frames)
+
+
+def window_bounds(cutoffs, trailing_days = 90):
+    '''
+    returns the earliest and latest receive dates kept for each IOU (its first
+    cutoff and trailing_days after its last), indexed by iou
+    '''
+    bounds = cutoffs.groupby('iou').date.agg(earliest = 'min', latest = 'max')
+    bounds['latest'] += pd.Timedelta(trailing_days, unit = 'day')
+
+    return bounds
+
+
+def window_filter(data, cutoffs, trailing_days = 90):
+    '''
+    returns the rows of data received between the first cutoff of their IOU
+    and trailing_days after its last cutoff. Rows of IOUs without cutoffs are
+    dropped.
+    '''
+    bounds = window_bounds(cutoffs, trailing_days)
+
+    #join the bounds of each row's IOU through its few distinct values, with NaT
+    #(which fails every comparison) for missing IOUs and IOUs without cutoffs
+    codes, uniques = pd.factorize(data.iou)
+    pos = np.append(bounds.index.get_indexer(uniques), -1)[codes]
+    earliest = np.append(bounds.earliest.to_numpy().astype('datetime64[ns]'), np.datetime64('NaT'))[pos]
+    latest = np.append(bounds.latest.to_numpy().astype('datetime64[ns]'), np.datetime64('NaT'))[pos]
+
+    receive = data.date_receive.to_numpy().astype('datetime64[ns]')
+    keep = (receive >= earliest) & (receive <= latest)
+
+    return data.loc[keep]
+
+
+def clean_projects(data, cutoffs, trailing_days = 90):
+    '''
+    returns the renamed raw project rows with lower-case IOUs and parsed dates,
+    restricted to the cutoff date window and to projects not self-installed.
+    '''
+    data = data.rename(columns = lambda c: column_name(c) or c)
+
+    #lower the case of iou
+    data.iou = data.iou.str.lower()
+
+    #convert dates to datetimes
+    for col in date_cols:
+        data[col] = pd.to_datetime(data[col])
+
+    #restrict sample to date range of cutoffs
+    with stage('window_filter', rows_in = data.shape[0]) as rec:
+        data = window_filter(data, cutoffs, trailing_days)
+        rec['rows_out'] = data.shape[0]
+
+    #take out self installers
+    with stage('self_install_filter', rows_in = data.shape[0]) as rec:
+        data = data.loc[data.self_install == 'No']
+        rec['rows_out'] = data.shape[0]
+
+    return compact(data)
+
+
+def is_imported(raw):
+    return column_name(raw) is not None
+
+
+def read_raw(path, chunksize = None, nrows = None, offset = 0):
+    '''
+    yields the raw rows of path (all at once, or in chunks of chunksize rows),
+    indexed by row number starting from offset. nrows limits the rows read
+    (None reads all).
+    '''
+    if chunksize is None:
+        chunks = [pd.read_csv(path, usecols = is_imported, nrows = nrows)]
+    else:
+        chunks = pd.read_csv(
+            path,
+            usecols = is_imported,
+            nrows = nrows,
+            chunksize = chunksize,
+        )
+
+    for chunk in chunks:
+        chunk.index = pd.RangeIndex(offset, offset + chunk.shape[0])
+        offset += chunk.shape[0]
+        yield chunk
+
+
+def read_projects(paths, cutoffs, chunksize = None, nrows = None, trailing_days = 90):
+    '''
+    returns the cleaned projects of every file in paths, in file order.
+    nrows limits the rows read from each file (None reads all). If chunksize
+    is given each file is streamed in chunks of that many rows and only the
+    rows surviving clean_projects are kept. The index numbers rows across all
+    files as if they had been read and concatenated at once.
+    '''
+    kept = []
+    offset = 0
+    with stage('read_projects', files = len(paths)) as rec:
+        for path in paths:
+            for chunk in read_raw(path, chunksize, nrows, offset):
+                offset += chunk.shape[0]
+                kept.append(clean_projects(chunk, cutoffs, trailing_days))
+        data = concat_projects(kept)
+        rec['rows_in'] = offset
+        rec['rows_out'] = data.shape[0]
+
+    return data
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Productivity of individual installers.
+
+The productivity regressions of prod_analysis.py are fitted on the
+installer-IOU-month-year panel written by data_clean.py: completed size or
+quantity on concurrent size or quantity, separately for every installer in
+every IOU. All installers are fitted at once (ols.fit_grouped), so the cost
+barely depends on their number.
+"""
+
+from ols import CONSTANT, fit_grouped
+from storage import read_panel
+from instrument import stage
+from prod_analysis import regressions
+
+#installers with fewer months of completed projects in an IOU are not fitted
+min_months = 12
+
+
+def load_panel():
+    '''
+    returns the installer panel, with only the columns used by the regressions
+    '''
+    return read_panel(
+        columns = [
+            'installer',
+            'iou',
+            'month_year',
+            'size_comp',
+            'size_conc',
+            'q_comp',
+            'q_conc',
+        ],
+    )
+
+
+def fit_installers(panel, regressions = regressions, min_months = min_months):
+    '''
+    returns the fit of every regression for every installer in every IOU with
+    at least min_months months in the panel, as a dataframe like ols.fit_batch
+    '''
+    months = panel.groupby(['installer', 'iou'], observed = True).month_year.transform('size')
+    panel = panel.loc[months >= min_months]
+
+    with stage('fit_grouped', rows_in = panel.shape[0], regressions = len(regressions)) as rec:
+        fits = fit_grouped(panel, regressions, ['installer', 'iou'])
+        rec['rows_out'] = fits.shape[0]
+
+    return fits
+
+
+def main(path = 'installer_fits.csv'):
+    '''
+    fits every installer and writes the fits to path
+    '''
+    fits = fit_installers(load_panel())
+    fits.to_csv(path, index = False)
+
+    #distribution of installers' slopes on concurrent work
+    slopes = fits.loc[fits.term != CONSTANT]
+    print(slopes.groupby(['regression', 'iou'], observed = True).coef.describe())
+
+    return fits
+
+
+if __name__ == '__main__':
+
+    main()
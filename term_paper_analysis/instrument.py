@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-stage instrumentation of the cleaning and analysis scripts.
+
+Wrapping a stage in `with stage(name, rows_in = n) as rec:` records its wall
+time, CPU time, peak RSS and, if the stage sets rec['rows_out'], the rows it
+kept and dropped. Stages nest, and each record names its parent. Records
+are appended as JSON lines to the file named by the PIPELINE_TRACE
+environment variable. Without it nothing is written and the overhead is a
+couple of clock reads.
+
+If PIPELINE_PROFILE names a directory, each stage (or only the stages listed,
+comma separated, in PIPELINE_PROFILE_STAGES) also runs under cProfile, and
+its stats are dumped there as {stage}-{pid}-{n}.prof for pstats or snakeviz.
+Sampling profilers such as py-spy attach from outside. The pid and
+start/end times in each record line their samples up with the stages.
+
+The settings are environment variables so worker processes inherit them.
+"""
+
+import os
+import sys
+import json
+import time
+import itertools
+import cProfile
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    #not available on Windows, where peak RSS is not recorded
+    resource = None
+
+#names of the stages currently running in this process, outermost first
+_stack = []
+_profiling = False
+_counter = itertools.count()
+
+
+def trace_path():
+    return os.environ.get('PIPELINE_TRACE')
+
+
+def profile_dir(name):
+    '''
+    returns the directory to dump the profile of stage name to, or None if it
+    is not profiled
+    '''
+    path = os.environ.get('PIPELINE_PROFILE')
+    stages = os.environ.get('PIPELINE_PROFILE_STAGES')
+    if path is None or (stages and name not in stages.split(',')):
+        return None
+
+    return path
+
+
+def peak_rss_mb():
+    '''
+    returns the peak resident memory of this process so far, in MB
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    #bytes on macOS, kilobytes elsewhere
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+
+def emit(record):
+    '''
+    appends record to the trace file as one JSON line
+    '''
+    path = trace_path()
+    if path is None:
+        return
+    with open(path, 'a') as f:
+        f.write(json.dumps(record, default = str) + '\n')
+
+
+@contextmanager
+def stage(name, rows_in = None, **fields):
+    '''
+    records the stage name run in the with block, with rows_in rows in and any
+    fields (e.g. iou) added to its record. Yields the record, in which the stage
+    can set rows_in, rows_out and further fields.
+    '''
+    global _profiling
+
+    record = {
+        'stage': name,
+        'parent': _stack[-1] if _stack else None,
+        'pid': os.getpid(),
+        **fields,
+        'rows_in': rows_in,
+    }
+
+    profiler = None
+    directory = profile_dir(name)
+    if directory is not None and not _profiling:
+        #only one profiler can run at a time, so nested stages are profiled with their parent
+        profiler = cProfile.Profile()
+        _profiling = True
+
+    _stack.append(name)
+    start = time.time()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            _profiling = False
+            os.makedirs(directory, exist_ok = True)
+            profiler.dump_stats(os.path.join(directory, f'{name}-{os.getpid()}-{next(_counter)}.prof'))
+        _stack.pop()
+
+        record['start'] = start
+        record['end'] = time.time()
+        record['wall_s'] = time.perf_counter() - wall
+        record['cpu_s'] = time.process_time() - cpu
+        record['peak_rss_mb'] = peak_rss_mb()
+        if record.get('rows_in') is not None and record.get('rows_out') is not None:
+            record['rows_dropped'] = record['rows_in'] - record['rows_out']
+        emit(record)
+
+
+def read_trace(path):
+    '''
+    returns the records of a trace file as a dataframe
+    '''
+    import pandas as pd
+
+    return pd.read_json(path, lines = True)
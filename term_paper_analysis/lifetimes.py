@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Interval index over project lifetimes, for concurrency queries.
+
+A project is open from the period of its receive date to the period of its
+complete date, both included, at a grain of a day, a week (starting on
+Monday) or a month. For each IOU, a LifetimeIndex holds the sweep line of the
+projects' lifetimes: each project enters at its first period and leaves at the
+period after its last, and running sums over the sorted events give the
+number of open projects and the sum of each feature over them after every
+event. How many projects are open at time t, and the sum of a feature over
+them, is then a binary search for the last event at or before t, whatever the
+number of projects or periods. Projects without both dates, or completed
+before they were received, are never open.
+
+Which projects are open at t is read off the projects sorted by first period,
+scanning only those that entered at or before t.
+"""
+
+import pandas as pd
+import numpy as np
+
+#numpy counts weeks from Thursday 1970-01-01, so weeks are floored from this Monday
+MONDAY = np.datetime64('1969-12-29', 'D')
+
+#pandas frequency of the period starts of each grain
+freqs = {
+    'day': 'D',
+    'week': 'W-MON',
+    'month': 'MS',
+}
+
+
+def periods(dates, grain = 'month'):
+    '''
+    returns the first day of the period (of grain 'day', 'week' or 'month')
+    of each of dates, as datetime64[D], NaT where a date is missing
+    '''
+    if grain not in freqs:
+        raise ValueError(f'unknown grain {grain}, not one of {list(freqs)}')
+    days = np.asarray(dates, dtype = 'datetime64[ns]').astype('datetime64[D]')
+
+    if grain == 'month':
+        return days.astype('datetime64[M]').astype('datetime64[D]')
+    if grain == 'week':
+        missing = np.isnat(days)
+        #floored on integer days, since timedelta division truncates towards zero
+        offset = (days - MONDAY).astype('int64')
+        weeks = MONDAY + (offset // 7 * 7).astype('timedelta64[D]')
+        weeks[missing] = np.datetime64('NaT')
+        return weeks
+
+    return days
+
+
+def next_periods(starts, grain = 'month'):
+    '''
+    returns the first day of the period after each period start in starts
+    '''
+    if grain == 'month':
+        return (starts.astype('datetime64[M]') + 1).astype('datetime64[D]')
+
+    return starts + (7 if grain == 'week' else 1)
+
+
+class LifetimeIndex:
+
+    def __init__(self, data, features = (), grain = 'month', group = 'iou',
+                 start = 'date_receive', end = 'date_complete'):
+        '''
+        indexes the lifetimes [start, end] of the projects in data by group,
+        at grain, with running sums of each of features (NaNs skipped)
+        '''
+        self.grain = grain
+        self.features = list(features)
+        self.index = data.index
+
+        first = periods(data[start].to_numpy(), grain)
+        leave = next_periods(periods(data[end].to_numpy(), grain), grain)
+        valid = ~np.isnat(first) & ~np.isnat(leave) & (first < leave)
+
+        values = data[self.features].to_numpy(dtype = 'float64', na_value = np.nan)
+        present = ~np.isnan(values)
+        values = np.where(present, values, 0)
+        #number of open projects, then the number with a value of each feature
+        present = np.column_stack([np.ones(data.shape[0], dtype = 'int64'), present.astype('int64')])
+
+        self.groups = {}
+        labels = data[group].to_numpy(dtype = object)
+        for g in pd.unique(labels[valid]):
+            rows = np.flatnonzero(valid & (labels == g))
+
+            #+1 at the first period of each project, -1 at the period after its last
+            times = np.concatenate([first[rows], leave[rows]])
+            order = np.argsort(times, kind = 'mergesort')
+            by_first = rows[np.argsort(first[rows], kind = 'mergesort')]
+            self.groups[g] = {
+                'times': times[order],
+                'sums': np.concatenate([values[rows], -values[rows]])[order].cumsum(axis = 0),
+                'counts': np.concatenate([present[rows], -present[rows]])[order].cumsum(axis = 0),
+                'rows': by_first,
+                'first': first[by_first],
+                'leave': leave[by_first],
+            }
+
+    def _state(self, g, t):
+        '''
+        returns the (sums, counts) after the last event of group g at or
+        before each time in t, with zero rows before the first event
+        '''
+        t = periods(np.atleast_1d(t), self.grain)
+        index = self.groups.get(g)
+        if index is None:
+            return np.zeros((t.size, len(self.features))), np.zeros((t.size, len(self.features) + 1), dtype = 'int64')
+
+        pos = np.searchsorted(index['times'], t, side = 'right') - 1
+        #before the first event (or at a missing time) nothing is open
+        none = (pos < 0) | np.isnat(t)
+        sums = index['sums'][np.maximum(pos, 0)]
+        counts = index['counts'][np.maximum(pos, 0)]
+        sums[none] = 0
+        counts[none] = 0
+
+        return sums, counts
+
+    def count(self, g, t):
+        '''
+        returns the number of projects of group g open at each time in t
+        '''
+        return self._state(g, t)[1][:, 0]
+
+    def sum(self, g, t, feature):
+        '''
+        returns the sum of feature over the projects of group g open at each
+        time in t, NaN where no open project has a value
+        '''
+        j = self.features.index(feature)
+        sums, counts = self._state(g, t)
+
+        return np.where(counts[:, j + 1] > 0, sums[:, j], np.nan)
+
+    def open(self, g, t):
+        '''
+        returns the index labels of the projects of group g open at time t
+        '''
+        index = self.groups.get(g)
+        t = periods(np.atleast_1d(t), self.grain)[0]
+        if index is None or np.isnat(t):
+            return self.index[:0]
+
+        entered = np.searchsorted(index['first'], t, side = 'right')
+        still_open = index['leave'][:entered] > t
+
+        return self.index[index['rows'][:entered][still_open]]
+
+    def query(self, groups, t, features = None):
+        '''
+        returns a dataframe with one row per (group, time) query in groups and
+        t, with the sum of each of features (default: all features indexed)
+        over the projects open then, NaN where no open project has a value
+        '''
+        features = self.features if features is None else list(features)
+        cols = [self.features.index(f) for f in features]
+        groups = np.asarray(groups, dtype = object)
+        t = np.asarray(t, dtype = 'datetime64[ns]')
+
+        totals = np.full((groups.size, len(features)), np.nan)
+        for g in pd.unique(groups):
+            queries = np.flatnonzero(groups == g)
+            sums, counts = self._state(g, t[queries])
+            totals[queries] = np.where(counts[:, [j + 1 for j in cols]] > 0, sums[:, cols], np.nan)
+
+        return pd.DataFrame(totals, columns = features)
+
+    def series(self, g, feature = None, first = None, last = None):
+        '''
+        returns the number of open projects of group g (or the sum of feature
+        over them) in every period from first to last (default: the first and
+        last periods in which any project is open), indexed by period start
+        '''
+        index = self.groups.get(g)
+        if first is None:
+            first = index['times'][0] if index is not None else None
+        if last is None:
+            last = index['times'][-1] - 1 if index is not None else None
+        if first is None or last is None:
+            return pd.Series(dtype = 'float64' if feature else 'int64')
+
+        starts = pd.date_range(periods([first], self.grain)[0], last, freq = freqs[self.grain])
+        if feature is None:
+            values = self.count(g, starts.to_numpy())
+        else:
+            values = self.sum(g, starts.to_numpy(), feature)
+
+        return pd.Series(values, index = starts, name = feature or 'open')
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batched OLS over many IOU x specification samples.
+
+Every design matrix with the same number of regressors is zero-padded to a
+common length and stacked, and all of them are solved at once with the
+normal equations (padding rows add nothing to X'X or X'y). Coefficients,
+standard errors (classical and HC1 robust) and nobs come back in one compact
+table. Full statsmodels results are only built on request.
+
+fit_grouped fits the same specifications in every one of many groups (e.g.
+installers) without padding, from per-group cross products of the design.
+
+The intercept is not stored with the data: a 'constant' regressor in a
+specification becomes a column of ones when the design matrix is built.
+"""
+
+import pandas as pd
+import numpy as np
+
+
+#name of the intercept in regression specifications
+CONSTANT = 'constant'
+
+
+def regressors(exog):
+    '''
+    returns the regressors of exog read from the data, i.e. all but the constant
+    '''
+    return [x for x in exog if x != CONSTANT]
+
+
+def select_sample(df, endog, exog):
+    '''
+    returns the rows of df[regressors(exog) + [endog]] without NaNs, as used by
+    every fit
+    '''
+    return df[regressors(exog) + [endog]].dropna()
+
+
+def design(df, exog):
+    '''
+    returns the (n, k) float64 design matrix of exog on the rows of df, with a
+    column of ones for the constant
+    '''
+    X = np.empty((df.shape[0], len(exog)))
+    for j, x in enumerate(exog):
+        if x == CONSTANT:
+            X[:, j] = 1
+        else:
+            X[:, j] = df[x].to_numpy('float64', na_value = np.nan)
+
+    return X
+
+
+def standard_errors(XtX_inv, rss, nobs, meat = None):
+    '''
+    returns the classical standard errors of a stack of B OLS fits with k
+    regressors from (X'X)^-1 (B, k, k), the residual sums of squares and nobs
+    (each (B,)), and their HC1 standard errors if meat, X' diag(e^2) X
+    (B, k, k), is given (else None)
+    '''
+    k = XtX_inv.shape[1]
+    df_resid = (nobs - k).astype('float64')
+    df_resid[df_resid <= 0] = np.nan
+
+    #classical covariance: s^2 (X'X)^-1
+    s2 = rss / df_resid
+    se = np.sqrt(s2[:, None] * np.diagonal(XtX_inv, axis1 = 1, axis2 = 2))
+    if meat is None:
+        return se, None
+
+    #HC1 covariance: n/(n-k) (X'X)^-1 X' diag(e^2) X (X'X)^-1
+    cov_hc1 = XtX_inv @ meat @ XtX_inv * (nobs / df_resid)[:, None, None]
+    se_robust = np.sqrt(np.diagonal(cov_hc1, axis1 = 1, axis2 = 2))
+
+    return se, se_robust
+
+
+def ols_stacked(Y, X, nobs):
+    '''
+    solves a stack of OLS problems. Y is (B, n), X is (B, n, k) and zero-padded
+    past nobs[b] rows. Returns coefficients, classical and HC1 standard errors,
+    each (B, k).
+    '''
+    XtX = np.einsum('bnk,bnl->bkl', X, X)
+    Xty = np.einsum('bnk,bn->bk', X, Y)
+    XtX_inv = np.linalg.pinv(XtX)
+    coef = np.einsum('bkl,bl->bk', XtX_inv, Xty)
+
+    resid = Y - np.einsum('bnk,bk->bn', X, coef)
+    meat = np.einsum('bnk,bn,bnl->bkl', X, resid ** 2, X)
+    se, se_robust = standard_errors(XtX_inv, (resid ** 2).sum(axis = 1), nobs, meat)
+
+    #an empty sample has no estimates
+    coef[nobs == 0] = np.nan
+
+    return coef, se, se_robust
+
+
+def fit_batch(df, regressions, groups, group = 'iou', slices = None):
+    '''
+    fits every regression in regressions (dict of title -> {'endog', 'exog'})
+    on the rows of df in each of groups, all in one batched solve per number
+    of regressors. Returns a dataframe with one row per regression, group and
+    regressor and columns coef, se, se_robust and nobs. If slices (a
+    slices.SliceCache of df by group) is given, samples are taken from it.
+    '''
+    if slices is None:
+        partitions = {g: sub for g, sub in df.groupby(group, sort = False)}
+
+    #collect designs, batched by number of regressors
+    batches = {}
+    for reg_title, var in regressions.items():
+        for g in groups:
+            if slices is None:
+                sub = partitions.get(g, df.iloc[:0])
+                sub = select_sample(sub, var['endog'], var['exog'])
+            else:
+                sub = slices.select(g, regressors(var['exog']) + [var['endog']])
+            key = (reg_title, g, tuple(var['exog']))
+            batches.setdefault(len(var['exog']), []).append(
+                (key, sub[var['endog']].to_numpy('float64', na_value = np.nan), design(sub, var['exog']))
+            )
+
+    rows = []
+    for k, designs in batches.items():
+        n_max = max(max(y.shape[0] for _, y, _ in designs), 1)
+        Y = np.zeros((len(designs), n_max))
+        X = np.zeros((len(designs), n_max, k))
+        nobs = np.zeros(len(designs), dtype = 'int64')
+        for b, (_, y, x) in enumerate(designs):
+            Y[b, :y.shape[0]] = y
+            X[b, :y.shape[0]] = x
+            nobs[b] = y.shape[0]
+
+        coef, se, se_robust = ols_stacked(Y, X, nobs)
+
+        for b, ((reg_title, g, exog), _, _) in enumerate(designs):
+            for j, term in enumerate(exog):
+                rows.append({
+                    'regression': reg_title,
+                    group: g,
+                    'term': term,
+                    'coef': coef[b, j],
+                    'se': se[b, j],
+                    'se_robust': se_robust[b, j],
+                    'nobs': nobs[b],
+                })
+
+    return pd.DataFrame(rows, columns = ['regression', group, 'term', 'coef', 'se', 'se_robust', 'nobs'])
+
+
+def group_crossprod(codes, X, n_groups, y = None, weights = None):
+    '''
+    returns the sums of w x x' (n_groups, k, k) and, if y is given, of w x y
+    (n_groups, k) (else None) over the rows x of X in each group of codes, with
+    w the weights of the rows (default 1)
+    '''
+    k = X.shape[1]
+    XtX = np.empty((n_groups, k, k))
+    Xty = None if y is None else np.empty((n_groups, k))
+    for a in range(k):
+        wx = X[:, a] if weights is None else weights * X[:, a]
+        if y is not None:
+            Xty[:, a] = np.bincount(codes, weights = wx * y, minlength = n_groups)
+        for b in range(a, k):
+            XtX[:, a, b] = np.bincount(codes, weights = wx * X[:, b], minlength = n_groups)
+            XtX[:, b, a] = XtX[:, a, b]
+
+    return XtX, Xty
+
+
+def fit_grouped(df, regressions, group):
+    '''
+    fits every regression in regressions (dict of title -> {'endog', 'exog'})
+    in every group of df by group (a column or list of columns) at once, from
+    per-group cross products accumulated in a few passes over the rows, so
+    tens of thousands of groups cost about as much as one. Returns a dataframe
+    like fit_batch, with one row per regression, group and regressor.
+    '''
+    by = [group] if isinstance(group, str) else list(group)
+
+    frames = []
+    for reg_title, var in regressions.items():
+        exog = var['exog']
+        k = len(exog)
+        sub = df.dropna(subset = by + regressors(exog) + [var['endog']])
+        codes = sub.groupby(by, observed = True, sort = True).ngroup().to_numpy()
+        n_groups = codes.max() + 1 if codes.size else 0
+
+        y = sub[var['endog']].to_numpy('float64', na_value = np.nan)
+        X = design(sub, exog)
+
+        nobs = np.bincount(codes, minlength = n_groups)
+        XtX, Xty = group_crossprod(codes, X, n_groups, y = y)
+        XtX_inv = np.linalg.pinv(XtX)
+        coef = np.einsum('gkl,gl->gk', XtX_inv, Xty)
+
+        resid = y - (X * coef[codes]).sum(axis = 1)
+        rss = np.bincount(codes, weights = resid ** 2, minlength = n_groups)
+        meat = group_crossprod(codes, X, n_groups, weights = resid ** 2)[0]
+        se, se_robust = standard_errors(XtX_inv, rss, nobs, meat)
+
+        #group keys from the first row of each group, repeated for each regressor
+        first = np.unique(codes, return_index = True)[1]
+        frame = sub[by].iloc[np.repeat(first, k)].reset_index(drop = True)
+        frame.insert(0, 'regression', reg_title)
+        frame['term'] = np.tile(exog, n_groups)
+        frame['coef'] = coef.ravel()
+        frame['se'] = se.ravel()
+        frame['se_robust'] = se_robust.ravel()
+        frame['nobs'] = np.repeat(nobs, k)
+        frames.append(frame)
+
+    return pd.concat(frames, ignore_index = True)
+
+
+def fitted_values(results, sub, reg_title, exog, g, group = 'iou'):
+    '''
+    returns the fitted values of a batched fit on the rows of sub
+    '''
+    res = results.loc[(results.regression == reg_title) & (results[group] == g)]
+    coef = res.set_index('term').coef[exog]
+
+    return pd.Series(design(sub, exog) @ coef.to_numpy(), index = sub.index)
+
+
+def fit_statsmodels(sub, endog, exog):
+    '''
+    returns a full statsmodels OLS result for one sample, for when summary
+    tables or diagnostics are needed
+    '''
+    import statsmodels.api as sm
+
+    sub = select_sample(sub, endog, exog)
+
+    X = pd.DataFrame(design(sub, exog), index = sub.index, columns = exog)
+
+    return sm.OLS(sub[endog].astype('float64'), X).fit()
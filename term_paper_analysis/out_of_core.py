@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Out-of-core cleaning of the CSI files, for samples that do not fit in memory.
+
+Each IOU's file is streamed in chunks, and every chunk is cleaned exactly as
+data_clean.py cleans the whole file. Its sample rows are spilled to a part
+file, and the partial totals of its projects (aggregate.partial_rollup, keyed
+by receive month and month inside the file) to one partial file per chunk,
+both by IOU and by installer and IOU. The IOU-month-year rollup and the
+installer panel are then merged from the partial totals of all chunks, and
+the sample parts are streamed into a single file. The sample written is
+identical to that of the in-memory path, the ioumy and panel equal up to
+rounding in the last bits (totals of a month are added chunk by chunk), and
+only one chunk and the partial totals are held in memory at a time.
+"""
+
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import numpy as np
+
+from schedule import load_cutoffs
+from ingest import read_raw, clean_projects
+from aggregate import partial_rollup, merge_partials, panel_partial, merge_panel
+from storage import SAMPLE_PATH, IOUMY_PATH, PANEL_PATH, sample_schema, write_table, write_parts, write_ioumy, write_panel
+from instrument import stage
+import data_clean
+
+WORK_DIR = 'out_of_core_parts'
+
+#columns the rollup reads, and the installer panel as well
+rollup_cols = ['iou', 'month_year_receive', 'month_year_complete'] + data_clean.outcomes
+panel_cols = data_clean.panel_groups + rollup_cols[1:]
+
+
+def write_partial(partial, path):
+    '''
+    writes the (complete, events) pair of a partial_rollup to one file, stacked
+    with a part column and with the index as columns
+    '''
+    complete, events = partial
+    frame = pd.concat([complete.assign(part = 'complete'), events.assign(part = 'events')])
+    frame.reset_index().to_feather(path)
+
+
+def read_partial(path, by = ('iou',)):
+    '''
+    returns the (complete, events) pair of a partial_rollup written to path
+    '''
+    frame = pd.read_feather(path).set_index(list(by) + ['receive', 'month'])
+    part = frame.pop('part')
+    complete = frame.loc[(part == 'complete').to_numpy()].astype({'first': 'int64'})
+    events = frame.loc[(part == 'events').to_numpy()].drop(columns = 'first')
+
+    return complete, events
+
+
+def spill_utility(iou, work_dir, chunksize, rows):
+    '''
+    cleans the file of an IOU chunk by chunk, spilling sample rows and partial
+    totals by IOU and by panel group under work_dir. Returns the sample part
+    paths, the rollup partial paths and the panel partial paths, one of each
+    per chunk in file order.
+    '''
+    cutoffs = load_cutoffs(iou)
+    iou_dir = os.path.join(work_dir, iou)
+    os.makedirs(iou_dir, exist_ok = True)
+
+    sample_parts = []
+    rollup_parts = []
+    panel_parts = []
+    pos = 0
+    for i, chunk in enumerate(read_raw(data_clean.csi_path(iou), chunksize, rows)):
+        data = data_clean.create_sample(clean_projects(chunk, cutoffs), cutoffs)
+
+        path = os.path.join(iou_dir, f'sample_{i:06d}.feather')
+        write_table(data, path, sample_schema)
+        sample_parts.append(path)
+
+        #position of each project among the cleaned projects of the IOU
+        positions = np.arange(pos, pos + data.shape[0])
+        pos += data.shape[0]
+
+        path = os.path.join(iou_dir, f'rollup_{i:06d}.feather')
+        write_partial(partial_rollup(data[rollup_cols], data_clean.outcomes, positions), path)
+        rollup_parts.append(path)
+
+        path = os.path.join(iou_dir, f'panel_{i:06d}.feather')
+        write_partial(panel_partial(data[panel_cols], data_clean.outcomes, data_clean.panel_groups, positions), path)
+        panel_parts.append(path)
+
+    return sample_parts, rollup_parts, panel_parts
+
+
+def clean_utility(iou, work_dir = WORK_DIR, chunksize = data_clean.chunksize, rows = data_clean.rows):
+    '''
+    returns the sample part paths, the ioumy and the installer panel of a
+    single IOU, computed out of core under work_dir
+    '''
+    if chunksize is None:
+        raise ValueError('out-of-core cleaning needs a chunksize')
+
+    with stage('spill_utility', iou = iou) as rec:
+        sample_parts, rollup_parts, panel_parts = spill_utility(iou, work_dir, chunksize, rows)
+        rec['chunks'] = len(rollup_parts)
+
+    with stage('merge_partials', iou = iou) as rec:
+        partials = [read_partial(p) for p in rollup_parts]
+        if not partials:
+            partials = [partial_rollup(pd.DataFrame(columns = rollup_cols), data_clean.outcomes)]
+
+        ioumy = merge_partials(partials, data_clean.outcomes)
+        rec['rows_out'] = ioumy.shape[0]
+
+    with stage('merge_panel', iou = iou) as rec:
+        partials = [read_partial(p, data_clean.panel_groups) for p in panel_parts]
+        if not partials:
+            partials = [panel_partial(pd.DataFrame(columns = panel_cols), data_clean.outcomes, data_clean.panel_groups)]
+
+        panel = merge_panel(partials, data_clean.outcomes, data_clean.panel_groups)
+        rec['rows_out'] = panel.shape[0]
+
+    return sample_parts, data_clean.format_ioumy(ioumy), panel
+
+
+def clean(ious = data_clean.ious, processes = data_clean.processes, work_dir = WORK_DIR,
+          chunksize = data_clean.chunksize, rows = data_clean.rows,
+          sample_path = SAMPLE_PATH, ioumy_path = IOUMY_PATH, panel_path = PANEL_PATH):
+    '''
+    cleans all IOUs out of core and writes the sample and ioumy, in the order
+    of ious, and the installer panel, as data_clean.py does in memory. Part
+    files are removed afterwards.
+    '''
+    args = [(iou, work_dir, chunksize, rows) for iou in ious]
+
+    try:
+        if processes > 1:
+            with ProcessPoolExecutor(max_workers = min(processes, len(ious))) as pool:
+                results = list(pool.map(clean_utility, *zip(*args)))
+        else:
+            results = [clean_utility(*a) for a in args]
+
+        write_parts([p for r in results for p in r[0]], sample_path, sample_schema)
+        write_ioumy(pd.concat([r[1] for r in results], ignore_index = True), ioumy_path)
+
+        #IOUs share no panel groups, so their panels only need to be sorted together
+        panel = pd.concat([r[2] for r in results], ignore_index = True)
+        panel = panel.sort_values(data_clean.panel_groups + ['month_year_complete'], kind = 'mergesort', ignore_index = True)
+        write_panel(data_clean.format_ioumy(panel), panel_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors = True)
+
+
+if __name__ == '__main__':
+
+    clean()
@@ -0,0 +1,586 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dependency graph of the cleaning and analysis stages, with a caching runner.
+
+Each stage is a function of the outputs of the stages it depends on. Its cache
+key hashes the source of the function and of every function and class of this
+project it reaches (found from the names in their code, see dependencies), the
+plain constants they read, its parameters, the keys of its inputs and the state of the raw files it reads, so
+a stage only reruns when something it depends on changed. Outputs are pickled
+to the cache directory under their key and only unpickled when a stage that
+does rerun needs them. The files a stage writes are recorded in a manifest
+with the key they were written under, so a file left behind by another key (or
+changed outside the pipeline) makes its stage rerun.
+
+Run as a script to bring the given targets (default: all) up to date:
+
+    python pipeline.py [target ...] [--force stage ...]
+"""
+
+import os
+import sys
+import json
+import pickle
+import inspect
+import hashlib
+import argparse
+import importlib
+
+import pandas as pd
+
+import instrument
+
+CACHE_DIR = 'pipeline_cache'
+MANIFEST = 'outputs.json'
+
+#modules of this project are the scripts next to this one
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Stage:
+
+    def __init__(self, name, func, inputs = (), params = None, files = (), outputs = (), code = ()):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.params = params or {}
+        self.files = list(files)
+        self.outputs = list(outputs)
+        self.code = list(code)
+
+
+def in_project(obj):
+    '''
+    returns whether obj is a module, function or class defined in this project
+    '''
+    module = obj if inspect.ismodule(obj) else inspect.getmodule(obj)
+    path = getattr(module, '__file__', None)
+
+    return path is not None and os.path.dirname(os.path.abspath(path)) == PROJECT_DIR
+
+
+def is_constant(value):
+    '''
+    returns whether value is a plain constant whose repr is its content
+    '''
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return all(is_constant(v) for v in value)
+    if isinstance(value, dict):
+        return all(is_constant(k) and is_constant(v) for k, v in value.items())
+
+    return value is None or isinstance(value, (bool, int, float, complex, str, bytes))
+
+
+def code_names(code):
+    '''
+    returns the global, attribute and imported names used by code and the
+    functions, lambdas and comprehensions nested in it
+    '''
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= code_names(const)
+
+    return names
+
+
+def project_module(name):
+    '''
+    returns the module of this project called name, or None
+    '''
+    if not os.path.exists(os.path.join(PROJECT_DIR, f'{name}.py')):
+        return None
+
+    return importlib.import_module(name)
+
+
+def dependencies(objs):
+    '''
+    returns the functions and classes of this project reached from objs
+    (functions, classes or modules) through the names in their code, and the
+    plain constants they read or take as defaults, as a sorted list of (name,
+    obj) and a dict of constants by name. Names are resolved in the module of
+    each function and in every module of this project it names (so
+    `from ingest import read_projects` inside a function, or
+    `ingest.read_projects`, reaches read_projects). Attribute names are
+    resolved the same way, which can only add dependencies, never miss one.
+    '''
+    found = {}
+    constants = {}
+    stack = list(objs)
+    while stack:
+        obj = stack.pop()
+        if inspect.ismodule(obj):
+            found[obj.__name__] = obj
+            continue
+        name = f'{obj.__module__}.{obj.__qualname__}'
+        if name in found:
+            continue
+        found[name] = obj
+
+        #a class is reached through the functions of its body
+        if inspect.isclass(obj):
+            functions = []
+            for member in vars(obj).values():
+                member = getattr(member, '__func__', getattr(member, 'fget', member))
+                if inspect.isfunction(member):
+                    functions.append(member)
+        else:
+            functions = [obj]
+
+        for func in functions:
+            defaults = (func.__defaults__ or ()) + tuple((func.__kwdefaults__ or {}).values())
+            if defaults and is_constant(defaults):
+                constants[f'{func.__module__}.{func.__qualname__}()'] = defaults
+
+            names = code_names(func.__code__)
+            modules = [func.__globals__]
+            for n in names:
+                module = func.__globals__.get(n)
+                if not (inspect.ismodule(module) and in_project(module)):
+                    module = project_module(n)
+                if module is not None:
+                    modules.append(vars(module))
+
+            for n in names:
+                for namespace in modules:
+                    value = namespace.get(n)
+                    if (inspect.isfunction(value) or inspect.isclass(value)) and in_project(value):
+                        stack.append(value)
+                    elif n in namespace and is_constant(value):
+                        constants[f'{namespace["__name__"]}.{n}'] = value
+
+    return sorted(found.items()), constants
+
+
+def source_digest(objs):
+    '''
+    returns a digest of the source code of objs and of everything of this
+    project they depend on, and of the constants they read
+    '''
+    found, constants = dependencies(objs)
+
+    h = hashlib.sha1()
+    for name, obj in found:
+        h.update(name.encode())
+        h.update(inspect.getsource(obj).encode())
+    h.update(repr(sorted(constants.items())).encode())
+
+    return h.hexdigest()
+
+
+def file_digest(path):
+    '''
+    returns a cheap digest of a raw input file from its size and modification
+    time (missing files hash as missing)
+    '''
+    if not os.path.exists(path):
+        return f'{path}:missing'
+    st = os.stat(path)
+
+    return f'{path}:{st.st_size}:{st.st_mtime_ns}'
+
+
+class Pipeline:
+
+    def __init__(self, cache_dir = CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.stages = {}
+
+    def add(self, name, func, inputs = (), params = None, files = (), outputs = (), code = ()):
+        if name in self.stages:
+            raise ValueError(f'stage {name} declared twice')
+        self.stages[name] = Stage(name, func, inputs, params, files, outputs, code)
+
+    def order(self, targets = None):
+        '''
+        returns the stages needed for targets (default: all) in dependency order
+        '''
+        if targets is None:
+            targets = list(self.stages)
+
+        ordered = []
+        visiting = set()
+
+        def visit(name):
+            if name in ordered:
+                return
+            if name not in self.stages:
+                raise KeyError(f'unknown stage {name}')
+            if name in visiting:
+                raise ValueError(f'cycle through stage {name}')
+            visiting.add(name)
+            for i in self.stages[name].inputs:
+                visit(i)
+            visiting.discard(name)
+            ordered.append(name)
+
+        for t in targets:
+            visit(t)
+
+        return ordered
+
+    def keys(self, ordered):
+        '''
+        returns the cache key of every stage in ordered
+        '''
+        keys = {}
+        for name in ordered:
+            stage = self.stages[name]
+            h = hashlib.sha1()
+            h.update(name.encode())
+            h.update(source_digest([stage.func] + stage.code).encode())
+            h.update(repr(sorted(stage.params.items())).encode())
+            for i in stage.inputs:
+                h.update(keys[i].encode())
+            for path in stage.files:
+                h.update(file_digest(path).encode())
+            keys[name] = h.hexdigest()[:16]
+
+        return keys
+
+    def cache_path(self, name, key):
+        safe = ''.join(c if c.isalnum() or c in '-_' else '_' for c in name)
+
+        return os.path.join(self.cache_dir, f'{safe}-{key}.pkl')
+
+    def manifest_path(self):
+        return os.path.join(self.cache_dir, MANIFEST)
+
+    def read_manifest(self):
+        '''
+        returns the key and file digest each output was last written under
+        '''
+        if not os.path.exists(self.manifest_path()):
+            return {}
+        with open(self.manifest_path()) as f:
+            return json.load(f)
+
+    def write_manifest(self, manifest):
+        #written to a temporary file first, so an interrupted run never leaves a partial manifest
+        tmp = self.manifest_path() + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent = 1)
+        os.replace(tmp, self.manifest_path())
+
+    def is_cached(self, name, key, manifest):
+        '''
+        returns whether the value of stage name is cached under key and each of
+        its outputs is still the file it wrote under key
+        '''
+        stage = self.stages[name]
+
+        return (
+            os.path.exists(self.cache_path(name, key))
+            and all(manifest.get(p) == [key, file_digest(p)] for p in stage.outputs)
+        )
+
+    def run(self, targets = None, force = ()):
+        '''
+        runs the stages of targets whose outputs are not cached under their
+        current key and returns the list of stages that ran
+        '''
+        ordered = self.order(targets)
+        keys = self.keys(ordered)
+        os.makedirs(self.cache_dir, exist_ok = True)
+        manifest = self.read_manifest()
+
+        values = {}
+
+        def load(name):
+            if name not in values:
+                with open(self.cache_path(name, keys[name]), 'rb') as f:
+                    values[name] = pickle.load(f)
+            return values[name]
+
+        ran = []
+        for name in ordered:
+            stage = self.stages[name]
+            if name not in force and self.is_cached(name, keys[name], manifest):
+                print(f'{name}: cached')
+                continue
+
+            print(f'{name}: running')
+            with instrument.stage(name, key = keys[name]):
+                values[name] = stage.func(*[load(i) for i in stage.inputs], **stage.params)
+            with open(self.cache_path(name, keys[name]), 'wb') as f:
+                pickle.dump(values[name], f)
+            for p in stage.outputs:
+                manifest[p] = [keys[name], file_digest(p)]
+            self.write_manifest(manifest)
+            ran.append(name)
+
+        return ran
+
+##############################################################################
+#stages of this project
+##############################################################################
+
+def ingest_stage(cutoffs, iou, chunksize, rows):
+    from ingest import read_projects
+    from data_clean import csi_path
+
+    return read_projects([csi_path(iou)], cutoffs, chunksize = chunksize, nrows = rows)
+
+
+def subsidy_stage(data, cutoffs):
+    from data_clean import create_sample
+
+    #copy since create_sample adds columns in place
+    return create_sample(data.copy(), cutoffs)
+
+
+def rollup_stage(data):
+    from data_clean import create_ioumy
+
+    return create_ioumy(data)
+
+
+def merge_stage(*parts):
+    from data_clean import sample_cols, create_installer_panel
+    from storage import write_sample, write_ioumy, write_panel
+
+    #first half of parts are the per-IOU samples, second half the per-IOU ioumys
+    n = len(parts) // 2
+    sample = pd.concat([p[sample_cols] for p in parts[:n]], ignore_index = True)
+    ioumy = pd.concat(parts[n:], ignore_index = True)
+
+    write_sample(sample)
+    write_ioumy(ioumy)
+    write_panel(create_installer_panel(sample))
+
+    return ioumy
+
+
+def fit_stage(ioumy, reg_title, var, ious):
+    from prod_analysis import fit_regression
+    from slices import SliceCache
+
+    return fit_regression(SliceCache(ioumy), reg_title, var, ious)
+
+
+def table_stage(fit, var, ious):
+    from prod_analysis import write_table
+
+    return write_table(fit[1], var, ious)
+
+
+def figure_stage(ioumy, fit, reg_title, var, iou):
+    from prod_analysis import plot_fit
+    from slices import SliceCache
+
+    return plot_fit(SliceCache(ioumy), fit[0], reg_title, var, iou)
+
+
+def rolling_stage(ioumy, regressions, windows, ious):
+    from rolling import fit_rolling
+    from slices import SliceCache
+
+    fits = fit_rolling(SliceCache(ioumy), regressions, windows, ious)
+    fits.to_csv('prod_rolling.csv', index = False)
+
+    return fits
+
+
+def installer_stage(ioumy, min_months):
+    from installer_analysis import load_panel, fit_installers
+
+    #the value of clean is its ioumy, the panel is read back from the file it wrote
+    fits = fit_installers(load_panel(), min_months = min_months)
+    fits.to_csv('installer_fits.csv', index = False)
+
+    return fits
+
+
+def cutoff_jumps_stage(ioumy, *cutoffs, bandwidths):
+    from event_study import DateIndex, cutoff_jumps, outcomes
+    from storage import read_sample
+
+    #the value of clean is its ioumy, the sample is read back from the file it wrote
+    sample = read_sample(columns = ['iou', 'date_receive'] + outcomes)
+    jumps = cutoff_jumps(DateIndex(sample), pd.concat(cutoffs, ignore_index = True), bandwidths = bandwidths)
+    jumps.to_csv('cutoff_jumps.csv', index = False)
+
+    return jumps
+
+
+def subsidy_sample_stage(ioumy):
+    from subsidy_analysis import load_sample
+
+    #the value of clean is its ioumy, the sample is read back from the file it wrote
+    return load_sample()
+
+
+def subsidy_fit_stage(sample, ious):
+    from subsidy_analysis import fit_ious
+
+    return fit_ious(sample, ious)
+
+
+def subsidy_table_stage(iou_res, ious):
+    from subsidy_analysis import write_table
+
+    return write_table(iou_res, ious)
+
+
+def inference_stage(sample, iou_res, ious, reps, shifts, processes):
+    from subsidy_analysis import run_inference
+
+    return run_inference(sample, iou_res, ious, reps, shifts, processes)
+
+
+def hist_stage(sample):
+    from subsidy_analysis import hist_specs
+    from figures import render_all
+
+    return render_all(hist_specs(sample, export = True))
+
+
+def build_pipeline(cache_dir = CACHE_DIR):
+    '''
+    returns the pipeline of data_clean.py, prod_analysis.py,
+    installer_analysis.py, event_study.py and subsidy_analysis.py (analysis.py
+    exports no tables or figures, so it has no stages)
+    '''
+    import schedule
+    import data_clean
+    import prod_analysis
+    import installer_analysis
+    import event_study
+    import subsidy_analysis
+    import features
+
+    pipeline = Pipeline(cache_dir)
+
+    for iou in data_clean.ious:
+        pipeline.add(
+            f'cutoffs_{iou}',
+            schedule.load_cutoffs,
+            params = {'iou': iou},
+            files = [schedule.dta_path(iou)],
+        )
+        pipeline.add(
+            f'ingest_{iou}',
+            ingest_stage,
+            inputs = [f'cutoffs_{iou}'],
+            params = {'iou': iou, 'chunksize': data_clean.chunksize, 'rows': data_clean.rows},
+            files = [data_clean.csi_path(iou)],
+        )
+        pipeline.add(
+            f'subsidy_{iou}',
+            subsidy_stage,
+            inputs = [f'ingest_{iou}', f'cutoffs_{iou}'],
+        )
+        pipeline.add(
+            f'rollup_{iou}',
+            rollup_stage,
+            inputs = [f'subsidy_{iou}'],
+        )
+
+    pipeline.add(
+        'clean',
+        merge_stage,
+        inputs = [f'subsidy_{iou}' for iou in data_clean.ious] + [f'rollup_{iou}' for iou in data_clean.ious],
+        outputs = ['sample.feather', 'ioumy.feather', 'installer_panel.feather'],
+    )
+
+    for reg_title, var in prod_analysis.regressions.items():
+        pipeline.add(
+            f'fit_{var["endog"]}',
+            fit_stage,
+            inputs = ['clean'],
+            params = {'reg_title': reg_title, 'var': var, 'ious': prod_analysis.ious},
+        )
+        pipeline.add(
+            f'table_{var["endog"]}',
+            table_stage,
+            inputs = [f'fit_{var["endog"]}'],
+            params = {'var': var, 'ious': prod_analysis.ious},
+            outputs = [f"{var['endog']}_res.tex"],
+        )
+        for iou in prod_analysis.ious:
+            pipeline.add(
+                f'figure_{var["endog"]}_{iou}',
+                figure_stage,
+                inputs = ['clean', f'fit_{var["endog"]}'],
+                params = {'reg_title': reg_title, 'var': var, 'iou': iou},
+                outputs = [f"../term paper/{var['endog']}_{iou}.png"],
+            )
+
+    pipeline.add(
+        'rolling',
+        rolling_stage,
+        inputs = ['clean'],
+        params = {'regressions': prod_analysis.regressions, 'windows': prod_analysis.windows, 'ious': prod_analysis.ious},
+        outputs = ['prod_rolling.csv'],
+    )
+
+    pipeline.add(
+        'installers',
+        installer_stage,
+        inputs = ['clean'],
+        params = {'min_months': installer_analysis.min_months},
+        outputs = ['installer_fits.csv'],
+    )
+
+    pipeline.add(
+        'cutoff_jumps',
+        cutoff_jumps_stage,
+        inputs = ['clean'] + [f'cutoffs_{iou}' for iou in event_study.ious],
+        params = {'bandwidths': event_study.bandwidths},
+        outputs = ['cutoff_jumps.csv'],
+    )
+
+    pipeline.add(
+        'subsidy_sample',
+        subsidy_sample_stage,
+        inputs = ['clean'],
+        outputs = [features.LEVELS_PATH],
+    )
+    pipeline.add(
+        'fit_log_gen_q',
+        subsidy_fit_stage,
+        inputs = ['subsidy_sample'],
+        params = {'ious': subsidy_analysis.ious},
+    )
+    pipeline.add(
+        'table_log_gen_q',
+        subsidy_table_stage,
+        inputs = ['fit_log_gen_q'],
+        params = {'ious': subsidy_analysis.ious},
+        outputs = ['log_gen_q_res.tex'],
+    )
+    pipeline.add(
+        'inference_log_gen_q',
+        inference_stage,
+        inputs = ['subsidy_sample', 'fit_log_gen_q'],
+        params = {
+            'ious': subsidy_analysis.ious,
+            'reps': subsidy_analysis.reps,
+            'shifts': subsidy_analysis.shifts,
+            'processes': subsidy_analysis.processes,
+        },
+        files = [schedule.dta_path(iou) for iou in subsidy_analysis.ious],
+        outputs = ['log_gen_q_inference.csv'],
+    )
+    pipeline.add(
+        'hists',
+        hist_stage,
+        inputs = ['subsidy_sample'],
+        outputs = [f'../term paper/app_hist_{iou}.png' for iou in subsidy_analysis.ious],
+    )
+
+    return pipeline
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Bring pipeline targets up to date.')
+    parser.add_argument('targets', nargs = '*', help = 'stages to bring up to date (default: all)')
+    parser.add_argument('--force', nargs = '*', default = [], help = 'stages to rerun even if cached')
+    args = parser.parse_args()
+
+    pipeline = build_pipeline()
+    ran = pipeline.run(args.targets or None, force = args.force)
+    print(f'{len(ran)} stage(s) ran', file = sys.stderr)
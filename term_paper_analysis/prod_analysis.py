@@ -6,20 +6,31 @@ Created on Tue Nov 30 14:45:49 2021
 @author: ivananich
 """
 
-import pandas as pd
-import statsmodels.api as sm
-from statsmodels.iolib.summary2 import summary_col
-import numpy as np
-from matplotlib import pyplot as plt
+from ols import regressors, fit_batch, fitted_values, fit_statsmodels
+from storage import read_ioumy
+from figures import render, render_all
+from instrument import stage
+from slices import SliceCache
+from rolling import fit_rolling
 
 ##############################################################################
 #import sample and IOU-month-year data
 ##############################################################################
 
-ioumy = pd.read_csv('ioumy.csv')
-
-#turn dates into datetimes
-ioumy.month_year = pd.to_datetime(ioumy.month_year)
+def load_ioumy():
+    '''
+    returns the IOU-month-year sample, with only the columns used by the regressions below
+    '''
+    return read_ioumy(
+        columns = [
+            'iou',
+            'month_year',
+            'size_comp',
+            'size_conc',
+            'q_comp',
+            'q_conc',
+        ],
+    )
 
 ##############################################################################
 #estimate productivity of installers in each IOU
@@ -51,7 +62,14 @@ regressions = {
         'exog': ['q_conc', 'constant'],
         },
 }
- 
+
+#declare rolling window widths in months (None for an expanding window) of the time-varying fits
+windows = [12, 24, 36, None]
+
+#declare most scatter points drawn per figure (None draws all) and processes to render in
+max_points = None
+processes = 4
+
 #create new names for vars in summary output table
 new_names = {
     'size_conc': 'Size Committed To',
@@ -59,89 +77,164 @@ new_names = {
     'constant': 'Constant',
 }
 
-for reg_title, var in regressions.items():
-    
-    #create empty list to OLS results  
+
+def select_iou(slices, reg_title, var, iou):
+    '''
+    returns the IOU sub sample of a regression without NaNs, from the slices of
+    ioumy (shared, so not to be modified in place)
+    '''
+    w_nans = slices.rows(iou)
+    #drop NaN
+    with stage('dropna', rows_in = w_nans, regression = reg_title, iou = iou) as rec:
+        sub_ioumy = slices.select(iou, regressors(var['exog']) + [var['endog']])
+        rec['rows_out'] = sub_ioumy.shape[0]
+    wo_nans = sub_ioumy.shape[0]
+    print(f'NaNs for {reg_title} in {iou}: {w_nans - wo_nans} out of {w_nans}')
+
+    return sub_ioumy
+
+
+def fit_regression(slices, reg_title, var, ious = ious, fits = None):
+    '''
+    returns the batched fits of a regression in every IOU and the full OLS
+    results needed for its summary table. The batched fits are taken from fits
+    (of fit_batch over any regressions) if given.
+    '''
+    if fits is None:
+        with stage('fit_batch', rows_in = slices.df.shape[0], regression = reg_title):
+            fits = fit_batch(slices.df, {reg_title: var}, ious, slices = slices)
+    else:
+        fits = fits.loc[fits.regression == reg_title].reset_index(drop = True)
+
     prod_res = []
-    prod_res_names = []
-    
-    #find max values among IOUS to set consistent limits to axes for plots below
-    y_max = ioumy[var['endog']].max()
-    x_max = ioumy[var['exog']].iloc[:,0].max()
-    
     for iou in ious:
-        #select IOU sub sample, copy to enable addition of fitted values later
-        sub_ioumy = ioumy.loc[ioumy.iou == iou][var['exog'] + [var['endog']]].copy()
-        w_nans = sub_ioumy.shape[0]
-        #drop NaN
-        sub_ioumy.dropna(inplace = True)
-        wo_nans = sub_ioumy.shape[0]
-        print(f'NaNs for {reg_title} in {iou}: {w_nans - wo_nans} out of {w_nans}')
-
-        
-        #get endogenous and exogenous variables
-        endog = sub_ioumy[var['endog']]
-        exog = sub_ioumy[var['exog']]
-        
-        #OLS
-        ols = sm.OLS(endog, exog)
-        ols_res = ols.fit()
-        
-        #add to lists for summary table
-        prod_res.append(ols_res)
-        prod_res_names.append(iou)
-        
+        sub_ioumy = select_iou(slices, reg_title, var, iou)
+
+        #full OLS result, only needed for the summary table
+        with stage('fit_ols', rows_in = sub_ioumy.shape[0], regression = reg_title, iou = iou):
+            ols_res = fit_statsmodels(sub_ioumy, var['endog'], var['exog'])
+
         #rename regressors for summary table
         names = ols_res.model.exog_names
         for i in range(len(names)):
             name = names[i]
             new_name = new_names[name]
             names[i] = new_name
-            
-        #add fitted values to sub_ioumy dataframe for plots
-        sub_ioumy['fitted'] = ols_res.fittedvalues
-        
-
-        #create plot with best fit line
-        fig, ax = plt.subplots(figsize = (8,6))
-        sub_ioumy.plot(
-            x = exog.iloc[:,0].name, 
-            y = endog.name, 
-            kind = 'scatter', 
-            ax = ax,
-        )
-        sub_ioumy.plot(
-            x = exog.iloc[:,0].name, 
-            y = 'fitted', 
-            kind = 'line', 
-            ax = ax, 
-            color='red', 
-            legend = False,
-        )
-        ax.set_ylabel(f'{reg_title} Installed Per Month')
-        ax.set_xlabel(f'Concurrent {reg_title} Committed To Per Month')
-        ax.set_title(f'{iou}, {reg_title} (N Months = {sub_ioumy.shape[0]})')
-        ax.set_aspect('equal')
-                
-        #find max values to set limits to axes
-        ax.set_xlim(0, 1.1*x_max)
-        ax.set_ylim(0,1.1*y_max)
-        
-        #export figures
-        fig.savefig(f"../term paper/{var['endog']}_{iou}.png")
-
-    #create summary table
+
+        prod_res.append(ols_res)
+
+    return fits, prod_res
+
+
+def write_table(prod_res, var, ious = ious):
+    '''
+    writes the summary table of a regression across IOUs and returns its latex
+    '''
+    from statsmodels.iolib.summary2 import summary_col
+
     sum_table = summary_col(
         prod_res,
-        model_names = prod_res_names,
-        regressor_order = ols_res.model.exog_names,
+        model_names = ious,
+        regressor_order = prod_res[-1].model.exog_names,
         drop_omitted = True,
         info_dict={
         'N':lambda x: "{0:d}".format(int(x.nobs)),
     }
     )
-    
+
+    latex = sum_table.as_latex()[49:-25]
     with open(f"{var['endog']}_res.tex", 'w') as f:
-        f.write(sum_table.as_latex()[49:-25])
+        f.write(latex)
+
+    return latex
+
+
+def plot_spec(slices, fits, reg_title, var, iou):
+    '''
+    returns the plot spec of a regression in an IOU with its best fit line
+    '''
+    #find max values among IOUS to set consistent limits to axes
+    y_max = slices.max(var['endog'])
+    x_max = slices.max(var['exog'][0])
+
+    #NaNs dropped as in the fit, whose counts are already reported
+    sub_ioumy = slices.select(iou, regressors(var['exog']) + [var['endog']])
+
+    #add fitted values to (a copy of) sub_ioumy for plots
+    sub_ioumy = sub_ioumy.assign(fitted = fitted_values(fits, sub_ioumy, reg_title, var['exog'], iou))
+
+    return {
+        'kind': 'fit',
+        'data': sub_ioumy,
+        'x': var['exog'][0],
+        'y': var['endog'],
+        'fitted': 'fitted',
+        'figsize': (8,6),
+        'ylabel': f'{reg_title} Installed Per Month',
+        'xlabel': f'Concurrent {reg_title} Committed To Per Month',
+        'title': f'{iou}, {reg_title} (N Months = {sub_ioumy.shape[0]})',
+        'aspect': 'equal',
+        'xlim': (0, 1.1*x_max),
+        'ylim': (0, 1.1*y_max),
+        'max_points': max_points,
+        'path': f"../term paper/{var['endog']}_{iou}.png",
+    }
+
+
+def plot_fit(slices, fits, reg_title, var, iou):
+    '''
+    plots a regression in an IOU with its best fit line and returns the figure path
+    '''
+    return render(plot_spec(slices, fits, reg_title, var, iou))
+
+
+def figure_specs(slices, fits, regressions = regressions, ious = ious):
+    '''
+    returns the plot specs of every regression in every IOU
+    '''
+    return [
+        plot_spec(slices, fits, reg_title, var, iou)
+        for reg_title, var in regressions.items()
+        for iou in ious
+    ]
+
+
+def main(tables = True, figures = True, rolling = True):
+    '''
+    fits every regression in every IOU, then (optionally) writes their summary
+    tables, renders their figures and writes their rolling and expanding window
+    fits to prod_rolling.csv
+    '''
+    #partition ioumy by IOU once, shared by every regression and plot below
+    slices = SliceCache(load_ioumy())
+
+    #fit every regression in every IOU in one batched solve
+    prod_fits = fit_batch(slices.df, regressions, ious, slices = slices)
+    print(prod_fits)
+
+    if tables:
+        for reg_title, var in regressions.items():
+            fits, prod_res = fit_regression(slices, reg_title, var, ious, fits = prod_fits)
+
+            #create summary table
+            write_table(prod_res, var, ious)
+
+    if figures:
+        specs = figure_specs(slices, prod_fits, regressions, ious)
+
+        #render all figures headless, in parallel
+        with stage('render_all', figures = len(specs)):
+            render_all(specs, processes = processes)
+
+    if rolling:
+        with stage('fit_rolling', windows = len(windows)) as rec:
+            rolling_fits = fit_rolling(slices, regressions, windows, ious)
+            rec['rows_out'] = rolling_fits.shape[0]
+        rolling_fits.to_csv('prod_rolling.csv', index = False)
+
+    return prod_fits
+
 
+if __name__ == '__main__':
 
+    main()
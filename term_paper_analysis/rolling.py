@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Rolling and expanding window OLS of the productivity regressions.
+
+Each IOU's sample is sorted by month and the running sums of x x', x y and y^2
+are taken once over its rows. Moving a window forward by a month is then a
+rank-one update of X'X and X'y (adding the newest month and dropping the
+oldest), and the sums over any window are the difference of two running sums,
+so every window of every width is solved from the same running sums with one
+batched solve per width instead of a fresh OLS per window.
+"""
+
+import pandas as pd
+import numpy as np
+
+from ols import regressors, design, standard_errors
+
+
+def prefix_stats(y, X):
+    '''
+    returns the running sums of X'X, X'y and y'y over the rows of y and X, each
+    with a leading zero, so the sums over rows [a, b) are the differences of
+    the running sums at b and a
+    '''
+    n, k = X.shape
+    XtX = np.zeros((n + 1, k, k))
+    Xty = np.zeros((n + 1, k))
+    yty = np.zeros(n + 1)
+    XtX[1:] = np.cumsum(X[:, :, None] * X[:, None, :], axis = 0)
+    Xty[1:] = np.cumsum(X * y[:, None], axis = 0)
+    yty[1:] = np.cumsum(y ** 2)
+
+    return XtX, Xty, yty
+
+
+def window_ols(prefix, start, stop):
+    '''
+    returns the coefficients and classical standard errors (each (W, k)) and
+    nobs of the OLS on rows [start, stop) of each window, from prefix_stats
+    '''
+    XtX, Xty, yty = prefix
+    k = XtX.shape[1]
+    XtX = XtX[stop] - XtX[start]
+    Xty = Xty[stop] - Xty[start]
+    yty = yty[stop] - yty[start]
+    nobs = stop - start
+
+    XtX_inv = np.linalg.pinv(XtX)
+    coef = np.einsum('wkl,wl->wk', XtX_inv, Xty)
+
+    #residual sum of squares from the window sums: y'y - 2b'X'y + b'X'Xb
+    rss = yty - 2 * (coef * Xty).sum(axis = 1) + np.einsum('wk,wkl,wl->w', coef, XtX, coef)
+    se = standard_errors(XtX_inv, np.maximum(rss, 0), nobs)[0]
+
+    #too few months to identify the coefficients
+    coef[nobs < k] = np.nan
+
+    return coef, se, nobs
+
+
+def fit_rolling(slices, regressions, windows, groups, time = 'month_year'):
+    '''
+    fits every regression in regressions in each of groups (from a
+    slices.SliceCache) over windows of each width in windows, in months, ending
+    at every month of the group's sample (None for an expanding window from the
+    first month). Returns a dataframe with one row per regression, group,
+    window, end month and regressor and columns coef, se and nobs. The window
+    column is <NA> for expanding windows.
+    '''
+    frames = []
+    for reg_title, var in regressions.items():
+        exog = var['exog']
+        for g in groups:
+            sub = slices.select(g, regressors(exog) + [var['endog'], time])
+            sub = sub.sort_values(time, kind = 'mergesort')
+
+            prefix = prefix_stats(sub[var['endog']].to_numpy('float64'), design(sub, exog))
+            months = sub[time].to_numpy().astype('datetime64[M]')
+            stop = np.arange(1, sub.shape[0] + 1)
+
+            for window in windows:
+                if window is None:
+                    start = np.zeros_like(stop)
+                else:
+                    #months after the end month minus the window
+                    start = np.searchsorted(months, months - (window - 1), side = 'left')
+                coef, se, nobs = window_ols(prefix, start, stop)
+
+                k = len(exog)
+                frames.append(pd.DataFrame({
+                    'regression': reg_title,
+                    slices.group: g,
+                    'window': pd.array([window] * (stop.size * k), dtype = 'Int64'),
+                    time: np.repeat(sub[time].to_numpy(), k),
+                    'term': np.tile(exog, stop.size),
+                    'coef': coef.ravel(),
+                    'se': se.ravel(),
+                    'nobs': np.repeat(nobs, k),
+                }))
+
+    return pd.concat(frames, ignore_index = True)
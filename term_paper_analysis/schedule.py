@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cutoff schedules of the CSI subsidy step-downs.
+
+Each IOU's Stata cutoff table is read once, its dates are assembled from the
+year/month/day columns in one vectorized call, and the schedule is checked to
+step down monotonically. The compiled schedule (dates and subsidyperwatt as
+numpy arrays) is cached to disk next to a hash of the .dta file it came
+from, so later loads skip Stata parsing until the file changes.
+"""
+
+import os
+import hashlib
+
+import pandas as pd
+import numpy as np
+
+CUTOFF_DIR = '../data/cutoffs'
+CACHE_DIR = 'cutoff_cache'
+
+
+def dta_path(iou, cutoff_dir = CUTOFF_DIR):
+    return os.path.join(cutoff_dir, f'{iou}cutoffs.dta')
+
+
+def validate_schedule(dates, subsidies, iou):
+    '''
+    raises ValueError unless cutoff dates strictly increase and the subsidy
+    never increases from one cutoff to the next
+    '''
+    if np.isnat(dates).any():
+        raise ValueError(f'{iou} cutoff schedule has missing dates')
+    if (np.diff(dates) <= np.timedelta64(0, 'ns')).any():
+        raise ValueError(f'{iou} cutoff dates are not strictly increasing')
+    if (np.diff(subsidies) > 0).any():
+        raise ValueError(f'{iou} subsidy per watt increases between cutoffs')
+
+
+def read_schedule(iou, cutoff_dir = CUTOFF_DIR):
+    '''
+    returns the (dates, subsidyperwatt) arrays of an IOU's cutoff table
+    '''
+    cutoffs = pd.read_stata(dta_path(iou, cutoff_dir))
+    cutoffs = cutoffs.rename(columns = {f'{iou}_day': 'day'})
+
+    #create date column unifying year, month, day
+    dates = pd.to_datetime(cutoffs[['year', 'month', 'day']].astype('int64'))
+    dates = dates.to_numpy().astype('datetime64[ns]')
+    subsidies = cutoffs.subsidyperwatt.to_numpy().astype('float64')
+
+    validate_schedule(dates, subsidies, iou)
+
+    return dates, subsidies
+
+
+def compile_schedule(iou, cutoff_dir = CUTOFF_DIR, cache_dir = CACHE_DIR):
+    '''
+    returns the (dates, subsidyperwatt) arrays of an IOU's cutoff table, from
+    the cache if it was compiled from the current .dta file
+    '''
+    with open(dta_path(iou, cutoff_dir), 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+
+    cache_path = os.path.join(cache_dir, f'{iou}_schedule.npz')
+    if os.path.exists(cache_path):
+        cached = np.load(cache_path)
+        if str(cached['digest']) == digest:
+            return cached['dates'], cached['subsidies']
+
+    dates, subsidies = read_schedule(iou, cutoff_dir)
+
+    os.makedirs(cache_dir, exist_ok = True)
+    np.savez(cache_path, dates = dates, subsidies = subsidies, digest = digest)
+
+    return dates, subsidies
+
+
+def load_cutoffs(iou, cutoff_dir = CUTOFF_DIR, cache_dir = CACHE_DIR):
+    '''
+    returns the cutoff schedule of an IOU as a dataframe of iou, date and
+    subsidyperwatt
+    '''
+    dates, subsidies = compile_schedule(iou, cutoff_dir, cache_dir)
+
+    return pd.DataFrame({
+        'iou': iou,
+        'date': dates,
+        'subsidyperwatt': subsidies,
+    })
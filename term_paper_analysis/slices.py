@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Memoized group x column set slices of a sample, for the regression loops.
+
+A SliceCache sorts the sample by group (IOU) once, so each group is a
+contiguous block. Rows without NaNs in a column set are found once per
+column set, and the resulting slice of each group is kept, so every
+specification and plot of the same IOU and columns shares one slice instead
+of re-filtering, copying and dropping NaNs. Column maxima are memoized too.
+Slices and masks are evicted least recently used first once there are more
+than maxsize of them, so exploring many specifications keeps memory bounded.
+
+Slices are shared: callers must not modify them in place.
+"""
+
+from collections import OrderedDict
+
+import pandas as pd
+import numpy as np
+
+
+class SliceCache:
+
+    def __init__(self, df, group = 'iou', maxsize = 128):
+        self.group = group
+        self.maxsize = maxsize
+
+        #sort by group once (keeping row order within groups), so each group is a block
+        codes, groups = pd.factorize(df[group])
+        order = np.argsort(codes, kind = 'mergesort')
+        self.df = df.iloc[order]
+        bounds = np.searchsorted(codes[order], np.arange(len(groups) + 1))
+        self.ranges = {g: (bounds[i], bounds[i + 1]) for i, g in enumerate(groups)}
+
+        self._masks = OrderedDict()
+        self._slices = OrderedDict()
+        self._maxima = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, cache, key):
+        if key in cache:
+            self.hits += 1
+            cache.move_to_end(key)
+            return cache[key]
+        self.misses += 1
+        return None
+
+    def _put(self, cache, key, value):
+        cache[key] = value
+        if len(cache) > self.maxsize:
+            cache.popitem(last = False)
+
+    def rows(self, g):
+        '''
+        returns the number of rows of group g
+        '''
+        start, stop = self.ranges.get(g, (0, 0))
+
+        return stop - start
+
+    def notna(self, cols):
+        '''
+        returns the mask over the sorted sample of rows without NaNs in cols
+        '''
+        key = tuple(cols)
+        mask = self._get(self._masks, key)
+        if mask is None:
+            mask = self.df[list(cols)].notna().all(axis = 1).to_numpy()
+            self._put(self._masks, key, mask)
+
+        return mask
+
+    def select(self, g, cols):
+        '''
+        returns the rows of group g without NaNs in cols, restricted to cols
+        '''
+        key = (g, tuple(cols))
+        sub = self._get(self._slices, key)
+        if sub is None:
+            start, stop = self.ranges.get(g, (0, 0))
+            keep = self.notna(cols)[start:stop]
+            sub = self.df.iloc[start:stop][list(cols)]
+            if not keep.all():
+                sub = sub.loc[keep]
+            self._put(self._slices, key, sub)
+
+        return sub
+
+    def max(self, col):
+        '''
+        returns the maximum of col over the whole sample
+        '''
+        if col not in self._maxima:
+            self._maxima[col] = self.df[col].max()
+
+        return self._maxima[col]
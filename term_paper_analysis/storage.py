@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Typed columnar handoff between data_clean.py and the analysis scripts.
+
+The project sample, the IOU-month-year sample and the installer panel are
+stored as uncompressed Arrow IPC (Feather v2) files with an explicit schema,
+so dates and dtypes survive the round trip. Categorical strings are stored dictionary-encoded and
+nullable integers keep their width, so the compact dtypes of the cleaned
+sample come back as they were written. Reads are memory-mapped and can be
+restricted to the columns an analysis actually uses.
+"""
+
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+
+SAMPLE_PATH = 'sample.feather'
+IOUMY_PATH = 'ioumy.feather'
+PANEL_PATH = 'installer_panel.feather'
+
+#dictionary-encoded string
+category = pa.dictionary(pa.int32(), pa.string())
+
+#pandas dtypes of arrow integers, nullable so missing values stay integers
+int_dtypes = {
+    pa.int8(): pd.Int8Dtype(),
+    pa.int16(): pd.Int16Dtype(),
+    pa.int32(): pd.Int32Dtype(),
+    pa.int64(): pd.Int64Dtype(),
+}
+
+sample_schema = pa.schema([
+    ('app_id', pa.string()),
+    ('iou', category),
+    ('app_status', category),
+    ('date_receive', pa.timestamp('ns')),
+    ('date_complete', pa.timestamp('ns')),
+    ('self_install', category),
+    ('installer', category),
+    ('size_dc', pa.float64()),
+    ('gen_q', pa.int32()),
+    ('month_year_receive', pa.timestamp('ns')),
+    ('inv_q', pa.int32()),
+    ('subsidy', pa.float64()),
+])
+
+ioumy_schema = pa.schema([
+    ('iou', pa.string()),
+    ('month_year', pa.timestamp('ns')),
+    ('size_comp', pa.float64()),
+    ('size_conc', pa.float64()),
+    ('gen_q_comp', pa.float64()),
+    ('gen_q_conc', pa.float64()),
+    ('inv_q_comp', pa.float64()),
+    ('inv_q_conc', pa.float64()),
+    ('q_comp', pa.float64()),
+    ('q_conc', pa.float64()),
+])
+
+#installer-IOU-month-year panel, with the columns of ioumy
+panel_schema = pa.schema([
+    ('installer', category),
+    ('iou', category),
+] + [ioumy_schema.field(name) for name in ioumy_schema.names[1:]])
+
+
+def to_table(df, path, schema):
+    '''
+    returns df as an arrow table to write to path, cast to schema. Raises if df
+    is missing a column of the schema.
+    '''
+    missing = [c for c in schema.names if c not in df.columns]
+    if missing:
+        raise KeyError(f'columns missing for {path}: {missing}')
+
+    df = df[schema.names].copy()
+    for field in schema:
+        if field.type == pa.string():
+            df[field.name] = df[field.name].astype('string')
+        elif field.type == category:
+            df[field.name] = df[field.name].astype('category')
+        elif field.type in int_dtypes:
+            df[field.name] = df[field.name].astype(int_dtypes[field.type])
+
+    return pa.Table.from_pandas(
+        df,
+        schema = schema,
+        preserve_index = False,
+    )
+
+
+def write_table(df, path, schema):
+    '''
+    writes df to path as an uncompressed Feather file, casting to schema.
+    Raises if df is missing a column of the schema.
+    '''
+    feather.write_feather(to_table(df, path, schema), path, compression = 'uncompressed')
+
+
+def write_parts(parts, path, schema):
+    '''
+    writes the Feather files in parts (each written with write_table and schema)
+    to path as one Feather file, in order, with one part in memory at a time.
+    Categorical columns get the sorted union of the categories of every part, as
+    if the parts had been concatenated in memory and written at once.
+    '''
+    if not parts:
+        raise ValueError(f'no parts to write to {path}')
+
+    categories = {field.name: set() for field in schema if field.type == category}
+    for part in parts:
+        table = feather.read_table(part, columns = list(categories), memory_map = True)
+        for name, cats in categories.items():
+            for chunk in table.column(name).chunks:
+                cats.update(chunk.dictionary.to_pylist())
+    dtypes = {name: pd.CategoricalDtype(sorted(cats)) for name, cats in categories.items()}
+
+    #Feather v2 is the Arrow IPC file format, written here one part at a time
+    writer = None
+    try:
+        for part in parts:
+            table = to_table(read_table(part).astype(dtypes), path, schema)
+            if writer is None:
+                writer = pa.ipc.new_file(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def read_table(path, columns = None):
+    '''
+    returns the dataframe stored at path, memory-mapped and restricted to
+    columns if given.
+    '''
+    table = feather.read_table(path, columns = columns, memory_map = True)
+
+    return table.to_pandas(types_mapper = int_dtypes.get)
+
+
+def write_sample(sample, path = SAMPLE_PATH):
+    write_table(sample, path, sample_schema)
+
+
+def read_sample(columns = None, path = SAMPLE_PATH):
+    return read_table(path, columns)
+
+
+def write_ioumy(ioumy, path = IOUMY_PATH):
+    write_table(ioumy, path, ioumy_schema)
+
+
+def read_ioumy(columns = None, path = IOUMY_PATH):
+    return read_table(path, columns)
+
+
+def write_panel(panel, path = PANEL_PATH):
+    write_table(panel, path, panel_schema)
+
+
+def read_panel(columns = None, path = PANEL_PATH):
+    return read_table(path, columns)
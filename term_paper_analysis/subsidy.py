@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Subsidy lookup against the CSI cutoff schedules.
+
+The cutoff schedule is indexed once per IOU (dates sorted ascending) and every
+project is resolved with a single as-of search on its application receive date.
+"""
+
+import pandas as pd
+import numpy as np
+
+
+def index_cutoffs(cutoffs):
+    '''
+    returns a dict mapping each IOU to a (dates, subsidyperwatt) pair of numpy
+    arrays sorted by cutoff date.
+    '''
+    schedule = {}
+    for iou, iou_cutoffs in cutoffs.groupby('iou', sort = False):
+        iou_cutoffs = iou_cutoffs.sort_values('date', kind = 'mergesort')
+        schedule[iou] = (
+            iou_cutoffs.date.to_numpy().astype('datetime64[ns]'),
+            iou_cutoffs.subsidyperwatt.to_numpy().astype('float64'),
+        )
+
+    return schedule
+
+
+def find_subsidies(data, schedule):
+    '''
+    returns the subsidy per watt in effect in each project's IOU on its
+    application receive date, i.e. the subsidy of the latest cutoff on or before
+    date_receive. Projects received before the first cutoff of their IOU (or
+    with no receive date, or in an IOU without a schedule) get a subsidy of 0.
+
+    schedule is either the cutoffs dataframe or the output of index_cutoffs.
+    '''
+    if isinstance(schedule, pd.DataFrame):
+        schedule = index_cutoffs(schedule)
+
+    iou = data.iou.to_numpy()
+    date_receive = data.date_receive.to_numpy().astype('datetime64[ns]')
+    subsidy = np.zeros(data.shape[0])
+
+    for u, (dates, subsidies) in schedule.items():
+        rows = np.flatnonzero(iou == u)
+        if rows.size == 0:
+            continue
+
+        #position of the latest cutoff on or before the receive date
+        pos = np.searchsorted(dates, date_receive[rows], side = 'right') - 1
+
+        #before the first cutoff (NaT sorts last, so mask it explicitly)
+        valid = (pos >= 0) & ~np.isnat(date_receive[rows])
+        subsidy[rows[valid]] = subsidies[pos[valid]]
+
+    return pd.Series(subsidy, index = data.index, name = 'subsidy')
@@ -7,143 +7,261 @@ Created on Tue Nov 30 14:45:49 2021
 """
 
 import pandas as pd
-import statsmodels.api as sm
-from statsmodels.iolib.summary2 import summary_col, Summary
 import numpy as np
-from matplotlib import pyplot as plt
-
 
+from fixed_effects import fit_fe
+from features import time_features, Levels, build_design
+from inference import cluster_bootstrap, bootstrap_ci, placebo_cutoffs
+from schedule import load_cutoffs
+from storage import read_sample
+from figures import render_all
+from instrument import stage
+
+#declare IOUs to analyze, in the order of the summary table
+ious = ['pge', 'sdge', 'sce']
+
+#declare bootstrap replicates, placebo shifts of all cutoff dates (in days) and processes
+reps = 10000
+shifts = [-365, -180, -90, -30, 30, 90, 180, 365]
+processes = 4
+
+#set to True to export the histograms
+export_hist = False
+
+#columns of the regression sample; a project missing any of them is dropped
+sample_cols = [
+    'app_id',
+    'iou',
+    'app_status',
+    'date_receive',
+    'date_complete',
+    'self_install',
+    'size_dc',
+    'gen_q',
+    'month_year_receive',
+    'inv_q',
+    'subsidy',
+]
 
 ##############################################################################
 #import sample data
 ##############################################################################
 
-sample = pd.read_csv('sample.csv')
-
-#change column names
-sample = sample.rename(
-    columns = {
-        'date_complete': 'date',
-        'month_year_receive': 'myr',
-        },
-)
-
-#turn dates into datetimes
-sample.date = pd.to_datetime(sample.date)
-
-#create time variable based on month
-sample.myr = pd.to_datetime(sample.myr)
-sample['myr_value'] = sample.myr.map(lambda x: x.value)
-sample.myr_value = sample.myr_value/10000000000
+def load_sample():
+    '''
+    returns the regression sample, without NaNs, with the time variable and
+    the logs of the regression variables
+    '''
+    #an explicit column list, so columns added to the sample file never change
+    #the rows dropped below
+    sample = read_sample(columns = sample_cols)
+
+    #change column names
+    sample = sample.rename(
+        columns = {
+            'date_complete': 'date',
+            'month_year_receive': 'myr',
+            },
+    )
 
-#drop NaNs
-sample.dropna(inplace = True)
+    #create time variable based on month (nanoseconds since the epoch / 1e10),
+    #and the month and year of each receive month-year
+    month, year, myr_value = time_features(sample.myr)
+    sample['myr_value'] = myr_value
+    sample['month'] = month
+    sample['year'] = year
+
+    #drop NaNs
+    with stage('dropna', rows_in = sample.shape[0]) as rec:
+        sample.dropna(inplace = True)
+        rec['rows_out'] = sample.shape[0]
+
+    ##############################################################################
+    # create vars
+    ##############################################################################
+    #month and year fixed effects as integer codes, numbered the same in every run
+    levels = Levels()
+    sample['month'] = levels.encode('month', sample.month.astype('int64'))
+    sample['year'] = levels.encode('year', sample.year.astype('int64'))
+    levels.save()
+
+    sample['log_size_dc'] = np.log(sample.size_dc)
+    sample['log_gen_q'] = np.log(sample.gen_q)
+    sample['log_subsidy'] = np.log(sample.subsidy)
+
+    return sample
 
 ##############################################################################
-# create vars
+# Analysis
 ##############################################################################
-sample['month'] = sample.myr.map(lambda x: str(x.month))
-sample['year'] = sample.myr.map(lambda x: str(x.year))
 
-months = pd.get_dummies(sample.month, drop_first = True)
-years = pd.get_dummies(sample.year, drop_first = True)
-ious = pd.get_dummies(sample.iou, drop_first = True)
+def fit_ious(sample, ious = ious):
+    '''
+    returns the fixed effects regression of log_gen_q on log_subsidy in each IOU
+    '''
+    iou_res = []
+    for iou in ious:
 
-sample = pd.concat([sample, months, years, ious], axis = 1)
+        sub_sample = sample.loc[sample.iou == iou]
 
-sample['log_size_dc'] = np.log(sample.size_dc)
-sample['log_gen_q'] = np.log(sample.gen_q)
-sample['log_subsidy'] = np.log(sample.subsidy)
+        #OLS with month and year fixed effects (and the constant) absorbed
+        with stage('fit_fe', rows_in = sub_sample.shape[0], iou = iou, endog = 'log_gen_q'):
+            ols_res = fit_fe(
+                sub_sample,
+                endog = 'log_gen_q',
+                exog = ['log_subsidy', 'myr_value'],
+                fe = ['month', 'year'],
+            )
+        iou_res.append(ols_res)
 
-sample['constant']=1
+    return iou_res
 
-##############################################################################
-# Analysis
-##############################################################################
 
+def write_table(iou_res, ious = ious):
+    '''
+    writes the summary table of the regressions across IOUs and returns it
+    '''
+    from statsmodels.iolib.summary2 import summary_col
 
-iou_res = []
-for iou in ['pge', 'sdge', 'sce']:
-   
-    sub_sample = sample.loc[sample.iou == iou]
-    
-    endog = sub_sample['log_gen_q']
+    sum_table = summary_col(
+            iou_res,
+            model_names = [iou.upper() for iou in ious],
+            regressor_order = ['log_subsidy',],
+            drop_omitted = True,
+            info_dict={
+            'N':lambda x: "{0:d}".format(int(x.nobs)),
+        }
+        )
 
-    #declare regressors
-    exog =  list(months.columns) + list(years.columns)
-    regressors = [
-        'log_subsidy',
-        'constant',
-        'myr_value',
-    ]
-    for v in regressors:
-        exog.append(v)
-    exog = sub_sample[exog]
-    
-    #OLS
-    ols = sm.OLS(endog, exog)
-    ols_res = ols.fit()
-    iou_res.append(ols_res)
-    
-
-sum_table = summary_col(
-        iou_res,
-        model_names = ['PGE', 'SDGE', 'SCE'],
-        regressor_order = ['log_subsidy',],
-        drop_omitted = True,
-        info_dict={
-        'N':lambda x: "{0:d}".format(int(x.nobs)),
-    }
-    )
+    print(sum_table)
 
-print(sum_table)
+    with open("log_gen_q_res.tex", 'w') as f:
+            f.write(sum_table.as_latex()[49:-50])
 
-with open("log_gen_q_res.tex", 'w') as f:
-        f.write(sum_table.as_latex()[49:-50])
+    return sum_table
 
 ##############################################################################
-# Create histogram displaying time trend of # of observations
+# Inference: cluster bootstrap and placebo cutoffs
 ##############################################################################
 
-bins = list(sample.myr.unique())
-bins.sort()
-
+def run_inference(sample, iou_res, ious = ious, reps = reps, shifts = shifts, processes = processes):
+    '''
+    returns the cluster bootstrap and placebo cutoff inference on log_subsidy in
+    each IOU, and writes it to log_gen_q_inference.csv
+    '''
+    cutoffs = pd.concat([load_cutoffs(iou) for iou in ious])
+    actual = dict(zip(ious, iou_res))
+
+    inference = []
+    for iou in ious:
+
+        sub_sample = sample.loc[sample.iou == iou]
+
+        #block bootstrap over receive month-years, from per-block X'X and X'y
+        #of the design with the month and year dummies, so every replicate
+        #re-estimates the fixed effects
+        y, X = build_design(
+            sub_sample.assign(constant = 1.0),
+            endog = 'log_gen_q',
+            exog = ['log_subsidy', 'myr_value', 'constant'],
+            fe = ['month', 'year'],
+        )
+        with stage('cluster_bootstrap', rows_in = sub_sample.shape[0], iou = iou, reps = reps):
+            coefs = cluster_bootstrap(
+                y,
+                X,
+                sub_sample.myr,
+                reps = reps,
+                processes = processes,
+                checkpoint_dir = 'bootstrap_checkpoints',
+            )
+        ci = bootstrap_ci(coefs[:, :2], ['log_subsidy', 'myr_value']).loc['log_subsidy']
+
+        #placebo cutoffs
+        with stage('placebo_cutoffs', rows_in = sub_sample.shape[0], iou = iou, shifts = len(shifts)):
+            placebo = placebo_cutoffs(
+                sub_sample,
+                cutoffs.loc[cutoffs.iou == iou],
+                shifts,
+                endog = 'log_gen_q',
+                exog = ['log_subsidy', 'myr_value'],
+                fe = ['month', 'year'],
+                processes = processes,
+            )
+        placebo['iou'] = iou
+        print(placebo)
+
+        inference.append({
+            'iou': iou,
+            'bootstrap_se': ci.se,
+            'ci_lower': ci.lower,
+            'ci_upper': ci.upper,
+            #share of placebo coefficients at least as large in magnitude as the actual one
+            'placebo_p': np.mean(np.abs(placebo.coef) >= np.abs(actual[iou].params['log_subsidy'])),
+        })
+
+    inference = pd.DataFrame(inference)
+    print(inference)
+    inference.to_csv('log_gen_q_inference.csv', index = False)
+
+    return inference
 
+##############################################################################
+# Create histogram displaying time trend of # of observations
+##############################################################################
 
-sub_df = sample[['myr', 'subsidy', 'iou']].copy()
-sub_df.subsidy = sub_df.subsidy * 1000
 colors = {
     'pge': 'red',
     'sce': 'green',
     'sdge': 'purple',
 }
-for iou in sub_df.iou.unique():
-    
-    fig, ax = plt.subplots(figsize = (16,8))
-
-    sub_df.loc[sub_df.iou == iou].plot(
-        x = 'myr', 
-        y = 'subsidy', 
-        kind = 'scatter',
-        ax = ax,
-        color = colors[iou],
-    )
-    sub_df.loc[sub_df.iou == iou].myr.hist(
-        bins = bins, 
-        ax = ax, 
-        alpha = 0.5,
-        color = colors[iou],
-    )
-    
-    ax.set_ylabel('Count/$/Kw')
-    ax.set_xlabel('Month')
-    ax.set_ylim(0, 3300)
-    
-    #fig.savefig(f"../term paper/app_hist_{iou}.png")
+
+def hist_specs(sample, export = export_hist):
+    '''
+    returns the plot specs of the histograms of applications (and subsidies)
+    over receive month-years in each IOU, with paths only if export
+    '''
+    bins = list(sample.myr.unique())
+    bins.sort()
+
+    sub_df = sample[['myr', 'subsidy', 'iou']].copy()
+    sub_df.subsidy = sub_df.subsidy * 1000
+
+    return [
+        {
+            'kind': 'hist',
+            'data': sub_df.loc[sub_df.iou == iou],
+            'x': 'myr',
+            'y': 'subsidy',
+            'bins': bins,
+            'color': colors[iou],
+            'figsize': (16,8),
+            'ylabel': 'Count/$/Kw',
+            'xlabel': 'Month',
+            'ylim': (0, 3300),
+            'path': f"../term paper/app_hist_{iou}.png" if export else None,
+        }
+        for iou in sub_df.iou.unique()
+    ]
 
 
+def main(inference = True, figures = True):
+    '''
+    fits and tabulates the subsidy regressions, then (optionally) runs their
+    inference and renders the histograms
+    '''
+    sample = load_sample()
+    iou_res = fit_ious(sample, ious)
+    write_table(iou_res, ious)
 
+    if inference:
+        run_inference(sample, iou_res, ious, reps, shifts, processes)
 
+    if figures:
+        render_all(hist_specs(sample, export_hist))
 
 
+#process pools must not be started again when workers import this script
+if __name__ == '__main__':
 
+    main()
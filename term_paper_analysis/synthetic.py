@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic CSI data, shaped like the Interconnected Project Sites files and the
+Stata cutoff tables, for benchmarking without the real snapshot.
+
+write_dataset writes a data directory laid out like ../data: one CSV per IOU
+(with the columns ingest.py imports, the equipment slots and a few unused
+columns) and one step-down cutoff schedule per IOU. Scale is configurable by
+rows, IOUs, date span, number of equipment slots and missing-equipment rate.
+Rows are generated and appended in blocks, so large files are written with
+bounded memory. The same seed always gives the same files.
+"""
+
+import os
+import argparse
+
+import pandas as pd
+import numpy as np
+
+SNAPSHOT = '2021-09-30'
+
+#rows generated and appended to a CSV at a time
+block = 500000
+
+
+def csv_path(root, iou):
+    return os.path.join(
+        root,
+        f'Interconnected_Project_Sites_{SNAPSHOT}',
+        f'{iou.upper()}_Interconnected_Project_Sites_{SNAPSHOT}.csv',
+    )
+
+
+def dta_path(root, iou):
+    return os.path.join(root, 'cutoffs', f'{iou}cutoffs.dta')
+
+
+def make_cutoffs(iou, start, end, steps, rng):
+    '''
+    returns a step-down cutoff table of an IOU as stored in the Stata files:
+    year, month, {iou}_day and subsidyperwatt, with steps cutoffs spread
+    between start and end
+    '''
+    dates = pd.date_range(start, end, periods = steps).normalize()
+    #stagger IOUs by a few days without reordering the steps
+    spacing = (pd.Timestamp(end) - pd.Timestamp(start)).days // max(steps, 2)
+    dates = dates + pd.to_timedelta(rng.integers(0, max(min(spacing // 2, 30), 1)), unit = 'day')
+
+    return pd.DataFrame({
+        'year': dates.year.astype('int16'),
+        'month': dates.month.astype('int8'),
+        f'{iou}_day': dates.day.astype('int8'),
+        'subsidyperwatt': np.round(np.linspace(2.5, 0.2, steps), 2),
+    })
+
+
+def make_projects(iou, rows, start, end, offset, rng, missing_rate = .2, slots = 5,
+                  installers = 500):
+    '''
+    returns rows of an IOU's Interconnected Project Sites file, with
+    application ids numbered from offset. Receive dates fall a little before
+    start to well after end, so the cutoff window filter has work to do.
+    '''
+    span = (pd.Timestamp(end) - pd.Timestamp(start)).days
+    receive = pd.Timestamp(start) + pd.to_timedelta(rng.integers(-60, span + 365, rows), unit = 'day')
+    complete = receive + pd.to_timedelta(rng.gamma(2, 60, rows).astype('int64'), unit = 'day')
+    has_complete = rng.random(rows) > .05
+
+    size_dc = np.round(rng.lognormal(1.5, .6, rows), 3)
+
+    #installer market shares are heavily skewed, as in the real data
+    installer = np.minimum(rng.zipf(1.3, rows), installers)
+
+    data = pd.DataFrame({
+        'Application Id': [f'{iou.upper()}-{i:09d}' for i in range(offset, offset + rows)],
+        'Utility': iou.upper(),
+        'Application Status': rng.choice(['Installed', 'Cancelled', 'Pending'], rows, p = [.85, .1, .05]),
+        'App Received Date': receive.strftime('%Y-%m-%d'),
+        'App Complete Date': np.where(has_complete, complete.strftime('%Y-%m-%d'), ''),
+        'Self Installer': rng.choice(['No', 'Yes'], rows, p = [.9, .1]),
+        'Installer Name': [f'Installer {i}' for i in installer],
+        'System Size DC': size_dc,
+        'System Size AC': np.round(size_dc * .85, 3),
+        'County': rng.choice(['Alameda', 'Fresno', 'Los Angeles', 'San Diego'], rows),
+    })
+
+    #later equipment slots are filled less and less often
+    for j in range(1, slots + 1):
+        filled = rng.random((2, rows)) > 1 - (1 - missing_rate) * .5 ** (j - 1)
+        inverters = rng.integers(1, 4, rows).astype('float64')
+        generators = np.ceil(size_dc * 1000 / 250 / j)
+        data[f'Inverter Quantity {j}'] = np.where(filled[0], inverters, np.nan)
+        data[f'Generator Quantity {j}'] = np.where(filled[1], generators, np.nan)
+
+    return data
+
+
+def write_dataset(root, rows, ious = ('pge', 'sce', 'sdge'), start = '2007-01-01',
+                  end = '2012-12-31', steps = 10, missing_rate = .2, slots = 5, seed = 0):
+    '''
+    writes a synthetic data directory under root with rows projects in total,
+    split evenly across ious, and a cutoff schedule of steps cutoffs between
+    start and end for each IOU
+    '''
+    rng = np.random.default_rng(seed)
+
+    for iou in ious:
+        path = dta_path(root, iou)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        make_cutoffs(iou, start, end, steps, rng).to_stata(path, write_index = False)
+
+        path = csv_path(root, iou)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        n = rows // len(ious)
+        for offset in range(0, max(n, 1), block):
+            projects = make_projects(
+                iou, min(block, n - offset), start, end, offset, rng,
+                missing_rate = missing_rate,
+                slots = slots,
+            )
+            projects.to_csv(path, index = False, mode = 'w' if offset == 0 else 'a', header = offset == 0)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Write a synthetic CSI data directory.')
+    parser.add_argument('root', help = 'directory to write (laid out like ../data)')
+    parser.add_argument('--rows', type = int, default = 10000, help = 'projects in total')
+    parser.add_argument('--ious', nargs = '+', default = ['pge', 'sce', 'sdge'])
+    parser.add_argument('--start', default = '2007-01-01', help = 'first cutoff date')
+    parser.add_argument('--end', default = '2012-12-31', help = 'last cutoff date')
+    parser.add_argument('--steps', type = int, default = 10, help = 'cutoffs per IOU')
+    parser.add_argument('--missing-rate', type = float, default = .2, help = 'share of missing first equipment slots')
+    parser.add_argument('--slots', type = int, default = 5, help = 'equipment slots per project')
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+
+    write_dataset(
+        args.root,
+        args.rows,
+        ious = args.ious,
+        start = args.start,
+        end = args.end,
+        steps = args.steps,
+        missing_rate = args.missing_rate,
+        slots = args.slots,
+        seed = args.seed,
+    )
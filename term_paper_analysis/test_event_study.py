@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Checks the cutoff jumps at the edges of the sample window.
+"""
+
+import pandas as pd
+import numpy as np
+
+from event_study import DateIndex, cutoff_jumps
+from ingest import window_filter
+
+
+def test_cutoff_jumps_edges():
+    cutoffs = pd.DataFrame({
+        'iou': 'pge',
+        'date': pd.to_datetime(['2010-01-01', '2010-07-01', '2011-01-01']),
+        'subsidyperwatt': [2.5, 2.0, 1.5],
+    })
+
+    #one application a day, cut to the sample window as in cleaning
+    days = pd.date_range('2009-06-01', '2011-12-31', freq = 'D')
+    sample = pd.DataFrame({'iou': 'pge', 'date_receive': days, 'size_dc': 5.0, 'gen_q': 10.0})
+    sample = window_filter(sample, cutoffs)
+
+    jumps = cutoff_jumps(DateIndex(sample), cutoffs, bandwidths = [30, 90, 120])
+    jumps = jumps.loc[jumps.outcome == 'applications'].set_index(['cutoff', 'bandwidth'])
+
+    #nothing before the first cutoff was kept: no spurious jump, but n reported
+    first = jumps.loc[pd.Timestamp('2010-01-01')]
+    assert first.before.isna().all() and first.jump.isna().all()
+    assert (first.after == 1).all() and (first.n_before == 0).all()
+
+    #after the last cutoff the sample runs 90 days: 120-day windows are cut short
+    last = jumps.loc[pd.Timestamp('2011-01-01')]
+    assert (last.loc[[30, 90], 'jump'] == 0).all()
+    assert np.isnan(last.loc[120, 'after']) and np.isnan(last.loc[120, 'jump'])
+    assert last.loc[120, 'before'] == 1 and last.loc[120, 'n_after'] == 91
+
+    #windows inside the sample are untouched
+    assert (jumps.loc[pd.Timestamp('2010-07-01'), 'jump'] == 0).all()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Checks the cluster bootstrap against a brute-force refit bootstrap.
+"""
+
+import pandas as pd
+import numpy as np
+
+from features import build_design
+from fixed_effects import fit_fe
+from inference import cluster_bootstrap
+
+
+def month_year_sample(seed = 1):
+    '''
+    returns a sample over 36 receive month-years, with month and year codes,
+    a stepped log subsidy, a time trend and month-year shocks in the outcome
+    '''
+    rng = np.random.default_rng(seed)
+    myr = pd.date_range('2010-01-01', periods = 36, freq = 'MS')
+    sizes = rng.integers(5, 15, myr.size)
+    sample = pd.DataFrame({'myr': np.repeat(myr, sizes)})
+
+    n = sample.shape[0]
+    sample['month'] = sample.myr.dt.month - 1
+    sample['year'] = sample.myr.dt.year - 2010
+    sample['myr_value'] = sample.myr.astype('int64') / 10000000000
+    sample['log_subsidy'] = np.log(2.5 - .1 * (sample.myr.dt.year - 2010 + sample.myr.dt.month // 4)) + rng.normal(0, .05, n)
+    shocks = rng.normal(0, .3, myr.size)
+    sample['log_gen_q'] = (
+        .7 * sample.log_subsidy
+        + 1e-8 * sample.myr_value
+        + .05 * sample.month
+        + np.repeat(shocks, sizes)
+        + rng.normal(0, .2, n)
+    )
+
+    return sample
+
+
+def test_cluster_bootstrap_matches_refit():
+    sample = month_year_sample()
+    exog = ['log_subsidy', 'myr_value']
+    reps, chunk, seed = 12, 5, 3
+
+    y, X = build_design(sample.assign(constant = 1.0), 'log_gen_q', exog + ['constant'], fe = ['month', 'year'])
+    coefs = cluster_bootstrap(y, X, sample.myr, reps = reps, chunk = chunk, processes = 2, seed = seed)
+
+    #the same cluster draws, as cluster_bootstrap makes them chunk by chunk
+    codes, clusters = pd.factorize(sample.myr)
+    sizes = [min(chunk, reps - start) for start in range(0, reps, chunk)]
+    draws = np.concatenate([
+        np.random.default_rng(s).multinomial(clusters.size, np.full(clusters.size, 1 / clusters.size), size = size)
+        for s, size in zip(np.random.SeedSequence(seed).spawn(len(sizes)), sizes)
+    ])
+
+    #refit with month and year fixed effects on the resampled rows
+    refits = np.array([
+        fit_fe(sample.loc[sample.index.repeat(w[codes])], 'log_gen_q', exog, ['month', 'year']).params.to_numpy()
+        for w in draws
+    ])
+
+    #myr_value is only identified through leap days next to the month and
+    #year effects, and not at all in draws without a leap year, so only the
+    #log_subsidy coefficients are compared
+    np.testing.assert_allclose(coefs[:, 0], refits[:, 0], rtol = 1e-6)